@@ -1,11 +1,35 @@
 import sqlite3
 import os
 import logging
+import threading
+
+from cachetools import TTLCache
 
 # Настройка логирования
 logger = logging.getLogger(__name__)
 
 
+def parse_notify_freq(notify_freq):
+    """Разбор строки notify_freq в (notify_kind, notify_hour, notify_minute, notify_dow)"""
+    try:
+        if notify_freq == 'hour':
+            return 'hour', None, 0, None
+        if notify_freq == 'day':
+            return 'day', 9, 0, None
+        if notify_freq == 'day_multi':
+            return 'day_multi', None, None, None
+        if notify_freq == 'week':
+            return 'week', 9, 0, 0
+        if notify_freq and notify_freq.startswith('day_'):
+            hour, minute = map(int, notify_freq[4:].split(':'))
+            return 'day', hour, minute, None
+        if notify_freq and notify_freq.startswith('week_'):
+            return 'week', 9, 0, int(notify_freq[5:])
+    except ValueError:
+        logger.error("Некорректная частота уведомлений: %s", notify_freq)
+    return 'off', None, None, None
+
+
 class Database:
     def __init__(self, db_name=None):
         # Проверяем наличие переменной окружения DATABASE_PATH
@@ -13,22 +37,43 @@ class Database:
             self.db_name = os.environ.get('DATABASE_PATH', 'time_tracker.db')
         else:
             self.db_name = db_name
+
+        # Журнал WAL включается только по DATABASE_WAL=1: он не работает, если база
+        # лежит на сетевом диске, поэтому по умолчанию используется обычный журнал
+        self.wal = os.environ.get('DATABASE_WAL', '').lower() in ('1', 'true', 'yes')
+
+        # Кэш данных пользователей (ставка, цель, заработок) - сбрасывается при любой записи
+        self._user_cache = TTLCache(maxsize=4096, ttl=60)
+        self._cache_lock = threading.Lock()
+        # Счетчик изменений пользователя: чтение, начатое до записи, не попадет в кэш
+        self._user_generation = {}
             
-        logger.info(f"Используется путь к базе данных: {self.db_name}")
+        logger.info("Используется путь к базе данных: %s", self.db_name)
         
         # Создаем директорию для базы данных, если она не существует
         db_dir = os.path.dirname(self.db_name)
         if db_dir and not os.path.exists(db_dir):
             os.makedirs(db_dir, exist_ok=True)
-            logger.info(f"Создана директория для базы данных: {db_dir}")
+            logger.info("Создана директория для базы данных: %s", db_dir)
             
         self._init_db()
 
+    def _connect(self):
+        """Открытие соединения с базой данных"""
+        conn = sqlite3.connect(self.db_name)
+        if self.wal:
+            # В режиме WAL синхронизации NORMAL достаточно: fsync выполняется при чекпойнте
+            conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
     def _init_db(self):
         """Инициализация базы данных и создание необходимых таблиц"""
         try:
-            conn = sqlite3.connect(self.db_name)
+            conn = self._connect()
             cursor = conn.cursor()
+
+            # Режим журнала сохраняется в файле базы, поэтому задаем его явно в обе стороны
+            cursor.execute(f"PRAGMA journal_mode={'WAL' if self.wal else 'DELETE'}")
             
             # Создаем таблицу пользователей
             cursor.execute('''
@@ -52,27 +97,59 @@ class Database:
                 FOREIGN KEY (user_id) REFERENCES users(user_id)
             )
             ''')
+
+            # Расписание уведомлений в отдельных столбцах (для баз, созданных до их появления)
+            cursor.execute("PRAGMA table_info(users)")
+            columns = {row[1] for row in cursor.fetchall()}
+            for column, column_type in (
+                ('notify_kind', 'TEXT'),
+                ('notify_hour', 'INTEGER'),
+                ('notify_minute', 'INTEGER'),
+                ('notify_dow', 'INTEGER')
+            ):
+                if column not in columns:
+                    cursor.execute(f"ALTER TABLE users ADD COLUMN {column} {column_type}")
+
+            # Заполняем расписание для пользователей, у которых есть только notify_freq
+            cursor.execute("SELECT user_id, notify_freq FROM users WHERE notify_kind IS NULL")
+            cursor.executemany(
+                "UPDATE users SET notify_kind = ?, notify_hour = ?, notify_minute = ?, notify_dow = ? WHERE user_id = ?",
+                [(*parse_notify_freq(freq), user_id) for user_id, freq in cursor.fetchall()]
+            )
+
+            # Индекс для ежеминутной выборки пользователей, которым пора отправить уведомление
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS ix_notify ON users(notify_kind, notify_hour, notify_minute, notify_dow)"
+            )
+
+            # Индекс для выборок и удаления записей времени пользователя
+            cursor.execute("CREATE INDEX IF NOT EXISTS ix_time_records_user ON time_records(user_id)")
             
             conn.commit()
             logger.info("База данных инициализирована успешно")
         except Exception as e:
-            logger.error(f"Ошибка при инициализации базы данных: {e}")
+            logger.error("Ошибка при инициализации базы данных: %s", e)
         finally:
             if conn:
                 conn.close()
 
     def user_exists(self, user_id):
         """Проверка существования пользователя в базе данных"""
+        # Пользователь, чьи данные есть в кэше, заведомо существует
+        with self._cache_lock:
+            if user_id in self._user_cache:
+                return True
+
         conn = None
         try:
-            conn = sqlite3.connect(self.db_name)
+            conn = self._connect()
             cursor = conn.cursor()
-            cursor.execute("SELECT 1 FROM users WHERE user_id = ?", (user_id,))
+            cursor.execute("SELECT 1 FROM users WHERE user_id = ? LIMIT 1", (user_id,))
             result = cursor.fetchone() is not None
-            logger.info(f"Проверка существования пользователя {user_id}: {result}")
+            logger.info("Проверка существования пользователя %s: %s", user_id, result)
             return result
         except Exception as e:
-            logger.error(f"Ошибка при проверке пользователя {user_id}: {e}")
+            logger.error("Ошибка при проверке пользователя %s: %s", user_id, e)
             return False
         finally:
             if conn:
@@ -82,28 +159,31 @@ class Database:
         """Добавление нового пользователя"""
         conn = None
         try:
-            conn = sqlite3.connect(self.db_name)
+            conn = self._connect()
             cursor = conn.cursor()
             
             # Проверяем, существует ли пользователь
             if self.user_exists(user_id):
                 # Если существует, обновляем данные
                 cursor.execute(
-                    "UPDATE users SET rate = ?, goal = ?, notify_freq = ? WHERE user_id = ?",
-                    (rate, goal, notify_freq, user_id)
+                    "UPDATE users SET rate = ?, goal = ?, notify_freq = ?, "
+                    "notify_kind = ?, notify_hour = ?, notify_minute = ?, notify_dow = ? WHERE user_id = ?",
+                    (rate, goal, notify_freq, *parse_notify_freq(notify_freq), user_id)
                 )
-                logger.info(f"Пользователь {user_id} обновлен в базе данных")
+                logger.info("Пользователь %s обновлен в базе данных", user_id)
             else:
                 # Если не существует, добавляем
                 cursor.execute(
-                    "INSERT INTO users (user_id, rate, goal, notify_freq) VALUES (?, ?, ?, ?)",
-                    (user_id, rate, goal, notify_freq)
+                    "INSERT INTO users (user_id, rate, goal, notify_freq, "
+                    "notify_kind, notify_hour, notify_minute, notify_dow) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (user_id, rate, goal, notify_freq, *parse_notify_freq(notify_freq))
                 )
-                logger.info(f"Пользователь {user_id} добавлен в базу данных")
+                logger.info("Пользователь %s добавлен в базу данных", user_id)
             
             conn.commit()
+            self.invalidate_user(user_id)
         except Exception as e:
-            logger.error(f"Ошибка при добавлении/обновлении пользователя {user_id}: {e}")
+            logger.error("Ошибка при добавлении/обновлении пользователя %s: %s", user_id, e)
             if conn:
                 conn.rollback()
             raise
@@ -115,13 +195,14 @@ class Database:
         """Обновление почасовой ставки пользователя"""
         conn = None
         try:
-            conn = sqlite3.connect(self.db_name)
+            conn = self._connect()
             cursor = conn.cursor()
             cursor.execute("UPDATE users SET rate = ? WHERE user_id = ?", (rate, user_id))
             conn.commit()
-            logger.info(f"Ставка пользователя {user_id} обновлена: {rate}")
+            self.invalidate_user(user_id)
+            logger.info("Ставка пользователя %s обновлена: %s", user_id, rate)
         except Exception as e:
-            logger.error(f"Ошибка при обновлении ставки пользователя {user_id}: {e}")
+            logger.error("Ошибка при обновлении ставки пользователя %s: %s", user_id, e)
             if conn:
                 conn.rollback()
         finally:
@@ -132,14 +213,15 @@ class Database:
         """Обновление цели пользователя"""
         conn = None
         try:
-            conn = sqlite3.connect(self.db_name)
+            conn = self._connect()
             cursor = conn.cursor()
             cursor.execute("UPDATE users SET goal = ? WHERE user_id = ?", (goal, user_id))
             conn.commit()
-            logger.info(f"Цель пользователя {user_id} обновлена: {goal}")
+            self.invalidate_user(user_id)
+            logger.info("Цель пользователя %s обновлена: %s", user_id, goal)
             return True
         except Exception as e:
-            logger.error(f"Ошибка при обновлении цели пользователя {user_id}: {e}")
+            logger.error("Ошибка при обновлении цели пользователя %s: %s", user_id, e)
             if conn:
                 conn.rollback()
             return False
@@ -151,14 +233,19 @@ class Database:
         """Обновление частоты уведомлений"""
         conn = None
         try:
-            conn = sqlite3.connect(self.db_name)
+            conn = self._connect()
             cursor = conn.cursor()
-            cursor.execute("UPDATE users SET notify_freq = ? WHERE user_id = ?", (notify_freq, user_id))
+            cursor.execute(
+                "UPDATE users SET notify_freq = ?, "
+                "notify_kind = ?, notify_hour = ?, notify_minute = ?, notify_dow = ? WHERE user_id = ?",
+                (notify_freq, *parse_notify_freq(notify_freq), user_id)
+            )
             conn.commit()
-            logger.info(f"Частота уведомлений пользователя {user_id} обновлена: {notify_freq}")
+            self.invalidate_user(user_id)
+            logger.info("Частота уведомлений пользователя %s обновлена: %s", user_id, notify_freq)
             return True
         except Exception as e:
-            logger.error(f"Ошибка при обновлении частоты уведомлений пользователя {user_id}: {e}")
+            logger.error("Ошибка при обновлении частоты уведомлений пользователя %s: %s", user_id, e)
             if conn:
                 conn.rollback()
             return False
@@ -166,26 +253,64 @@ class Database:
             if conn:
                 conn.close()
 
+    def get_users_due(self, hour, minute, weekday, kinds=()):
+        """Получение ID пользователей, которым нужно отправить уведомление в указанное время"""
+        # kinds - типы уведомлений без времени в базе, которые срабатывают в эту минуту
+        query = (
+            "SELECT user_id FROM users "
+            "WHERE (notify_kind = 'day' AND notify_hour = ? AND notify_minute = ?) "
+            "OR (notify_kind = 'week' AND notify_hour = ? AND notify_minute = ? AND notify_dow = ?)"
+        )
+        params = [hour, minute, hour, minute, weekday]
+        if kinds:
+            query += f" OR notify_kind IN ({', '.join('?' * len(kinds))})"
+            params.extend(kinds)
+
+        conn = self._connect()
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+        result = cursor.fetchall()
+        conn.close()
+        
+        return [row[0] for row in result]
+
+    def invalidate_user(self, user_id):
+        """Удаление данных пользователя из кэша после изменения"""
+        with self._cache_lock:
+            self._user_cache.pop(user_id, None)
+            self._user_generation[user_id] = self._user_generation.get(user_id, 0) + 1
+
     def get_user_data(self, user_id):
         """Получение данных пользователя"""
-        conn = sqlite3.connect(self.db_name)
+        with self._cache_lock:
+            cached = self._user_cache.get(user_id)
+            generation = self._user_generation.get(user_id, 0)
+        if cached:
+            return dict(cached)
+
+        conn = self._connect()
         cursor = conn.cursor()
         cursor.execute("SELECT rate, goal, earned, notify_freq FROM users WHERE user_id = ?", (user_id,))
         result = cursor.fetchone()
         conn.close()
         
         if result:
-            return {
+            data = {
                 "rate": result[0],
                 "goal": result[1],
                 "earned": result[2],
                 "notify_freq": result[3]
             }
+            with self._cache_lock:
+                # Пока шло чтение, данные могли измениться - тогда не кэшируем устаревшую строку
+                if self._user_generation.get(user_id, 0) == generation:
+                    self._user_cache[user_id] = data
+            return dict(data)
         return None
 
     def add_time_record(self, user_id, minutes):
         """Добавление записи о потраченном времени"""
-        conn = sqlite3.connect(self.db_name)
+        conn = self._connect()
         cursor = conn.cursor()
         
         # Получаем ставку пользователя
@@ -208,13 +333,14 @@ class Database:
         )
         
         conn.commit()
+        self.invalidate_user(user_id)
         conn.close()
         
         return earnings
 
     def get_time_history(self, user_id, limit=10):
         """Получение истории записей времени"""
-        conn = sqlite3.connect(self.db_name)
+        conn = self._connect()
         cursor = conn.cursor()
         cursor.execute(
             "SELECT minutes, earnings, timestamp FROM time_records WHERE user_id = ? ORDER BY timestamp DESC LIMIT ?",
@@ -249,7 +375,7 @@ class Database:
         """Получение общего количества затраченных часов"""
         conn = None
         try:
-            conn = sqlite3.connect(self.db_name)
+            conn = self._connect()
             cursor = conn.cursor()
             cursor.execute(
                 "SELECT SUM(minutes) FROM time_records WHERE user_id = ?",
@@ -257,20 +383,44 @@ class Database:
             )
             total_minutes = cursor.fetchone()[0] or 0
             total_hours = total_minutes / 60
-            logger.info(f"Общее количество часов пользователя {user_id}: {total_hours}")
+            logger.info("Общее количество часов пользователя %s: %s", user_id, total_hours)
             return total_hours
         except Exception as e:
-            logger.error(f"Ошибка при получении общего времени для пользователя {user_id}: {e}")
+            logger.error("Ошибка при получении общего времени для пользователя %s: %s", user_id, e)
             return 0
         finally:
             if conn:
                 conn.close()
 
+    def delete_time_records(self, user_id):
+        """Удаление всех записей времени пользователя и сброс заработка"""
+        conn = None
+        try:
+            conn = self._connect()
+            cursor = conn.cursor()
+
+            # Оба изменения - в одной транзакции
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute("DELETE FROM time_records WHERE user_id = ?", (user_id,))
+            cursor.execute("UPDATE users SET earned = 0 WHERE user_id = ?", (user_id,))
+            conn.commit()
+            self.invalidate_user(user_id)
+            logger.info("Удалены все записи времени для пользователя %s", user_id)
+            return True
+        except Exception as e:
+            logger.error("Ошибка при удалении записей времени пользователя %s: %s", user_id, e)
+            if conn:
+                conn.rollback()
+            return False
+        finally:
+            if conn:
+                conn.close()
+
     def reset_goal(self, user_id):
         """Сбрасывает текущий прогресс (earned) пользователя, но сохраняет историю"""
         conn = None
         try:
-            conn = sqlite3.connect(self.db_name)
+            conn = self._connect()
             cursor = conn.cursor()
             
             # Получаем текущие значения, чтобы их сохранить
@@ -278,7 +428,7 @@ class Database:
             result = cursor.fetchone()
             
             if not result:
-                logger.error(f"Пользователь {user_id} не найден при сбросе цели")
+                logger.error("Пользователь %s не найден при сбросе цели", user_id)
                 return False
                 
             rate, goal, earned = result
@@ -287,13 +437,14 @@ class Database:
             cursor.execute("UPDATE users SET earned = 0 WHERE user_id = ?", (user_id,))
             
             # Добавляем запись о сбросе в журнал (можно расширить бд для этого)
-            logger.info(f"Сброшен прогресс для пользователя {user_id}. Было заработано: {earned}")
+            logger.info("Сброшен прогресс для пользователя %s. Было заработано: %s", user_id, earned)
             
             conn.commit()
+            self.invalidate_user(user_id)
             return True
             
         except Exception as e:
-            logger.error(f"Ошибка при сбросе цели пользователя {user_id}: {e}")
+            logger.error("Ошибка при сбросе цели пользователя %s: %s", user_id, e)
             if conn:
                 conn.rollback()
             return False
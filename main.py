@@ -1,18 +1,27 @@
 import logging
 import os
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton
+from telegram.error import BadRequest, RetryAfter
 from telegram.ext import (
     Updater, CommandHandler, MessageHandler, Filters, 
-    CallbackContext, ConversationHandler, CallbackQueryHandler, JobQueue
+    CallbackContext, ConversationHandler, CallbackQueryHandler, ExtBot
 )
+from telegram.utils.request import Request
 from apscheduler.schedulers.background import BackgroundScheduler
 from dotenv import load_dotenv
 import pytz
-import sqlite3
 import types
+from types import MappingProxyType
 import re
 import sys
+import time
+import datetime
+import heapq
+import math
+from concurrent.futures import ThreadPoolExecutor
+import threading
 import atexit
+from collections import defaultdict, deque, namedtuple
 
 from database import Database
 from utils import (
@@ -38,45 +47,435 @@ logger = logging.getLogger(__name__)
     RESET_GOAL_CONFIRM
 ) = range(8)
 
+# Часовой пояс для задач планировщика
+UTC = pytz.UTC
+
+# Названия дней недели в винительном падеже («в понедельник»), индекс - day_of_week
+DAY_NAMES_ACC = ("понедельник", "вторник", "среду", "четверг", "пятницу", "субботу", "воскресенье")
+
+# Описание простых периодичностей уведомлений
+FREQ_TEXT = MappingProxyType({
+    'hour': 'ежечасно',
+    'day': 'ежедневно в 09:00',
+    'week': 'еженедельно в понедельник'
+})
+
+# Группировка пересланных таймеров: одиночный таймер подтверждается сразу, а если за GROUP_TIMER_DELAY
+# секунд пришел еще один, они собираются в группу. Группа обрабатывается через GROUP_TIMER_DELAY секунд
+# после последнего таймера или сразу, как только в ней набралось MAX_GROUP_BATCH таймеров
+GROUP_TIMER_DELAY = 2
+MAX_GROUP_BATCH = 10
+
+# Сообщение от бота-таймера: «Таймер остановлен ... Затрачено ...» (в любом порядке и регистре)
+TIMER_MESSAGE_RE = re.compile(r'^(?=.*таймер остановлен)(?=.*затрачено)', re.IGNORECASE | re.DOTALL)
+# Более короткий текст (ставка, цель, время) не может быть сообщением таймера
+TIMER_MESSAGE_MIN_LEN = len('таймер остановлен') + len('затрачено')
+
+# Бот обрабатывает только сообщения и нажатия кнопок, остальные обновления Telegram не присылает
+ALLOWED_UPDATES = ['message', 'callback_query']
+
+# Время в формате ЧЧ:ММ
+HHMM_RE = re.compile(r'^(\d{1,2}):(\d{2})$')
+
+# Обозначения валюты, которые пользователи дописывают к ставке и цели
+CURRENCY_RE = re.compile(r'₽|руб|р')
+
+# Статические клавиатуры (создаются один раз при загрузке модуля)
+# Главное меню
+KB_MAIN_MENU = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("Добавить время", callback_data='add_time')
+    ],
+    [
+        InlineKeyboardButton("История", callback_data='history'),
+        InlineKeyboardButton("Настройки", callback_data='settings')
+    ]
+])
+
+# Быстрое добавление времени
+KB_ADD_TIME = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("15 мин", callback_data='time_15'),
+        InlineKeyboardButton("30 мин", callback_data='time_30')
+    ],
+    [
+        InlineKeyboardButton("1 час", callback_data='time_60'),
+        InlineKeyboardButton("2 часа", callback_data='time_120')
+    ],
+    [
+        InlineKeyboardButton("Ввести вручную", callback_data='time_manual')
+    ],
+    [
+        InlineKeyboardButton("« Назад", callback_data='main_menu')
+    ]
+])
+
+# Возврат в главное меню
+KB_BACK_TO_MAIN = InlineKeyboardMarkup([
+    [InlineKeyboardButton("« Назад", callback_data='main_menu')]
+])
+
+# Меню настроек
+KB_SETTINGS = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("Изменить ставку", callback_data='change_rate'),
+        InlineKeyboardButton("Изменить цель", callback_data='change_goal')
+    ],
+    [
+        InlineKeyboardButton("Уведомления", callback_data='notifications'),
+        InlineKeyboardButton("Сбросить прогресс", callback_data='reset_goal')
+    ],
+    [
+        InlineKeyboardButton("« Назад", callback_data='main_menu')
+    ]
+])
+
+# Выбор времени ежедневных уведомлений
+KB_NOTIFY_TIMES = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("09:00", callback_data='notify_day_time_9_00'),
+        InlineKeyboardButton("12:00", callback_data='notify_day_time_12_00'),
+    ],
+    [
+        InlineKeyboardButton("15:00", callback_data='notify_day_time_15_00'),
+        InlineKeyboardButton("18:00", callback_data='notify_day_time_18_00'),
+    ],
+    [
+        InlineKeyboardButton("21:00", callback_data='notify_day_time_21_00'),
+        InlineKeyboardButton("23:00", callback_data='notify_day_time_23_00'),
+    ],
+    [
+        InlineKeyboardButton("Своё время", callback_data='notify_day_custom'),
+        InlineKeyboardButton("« Назад", callback_data='notify_settings')
+    ]
+])
+
+# Возврат в настройки
+KB_BACK_TO_SETTINGS = InlineKeyboardMarkup([
+    [InlineKeyboardButton("« Назад", callback_data='settings')]
+])
+
+# Подтверждение сброса прогресса
+KB_RESET_GOAL = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("Отмена", callback_data='settings'),
+        InlineKeyboardButton("Да, сбросить", callback_data='reset_goal_confirm')
+    ]
+])
+
+# После сброса прогресса
+KB_AFTER_RESET = InlineKeyboardMarkup([
+    [InlineKeyboardButton("Установить цель заработка", callback_data='change_goal')],
+    [InlineKeyboardButton("Вернуться в меню", callback_data='main_menu')]
+])
+
+# Все варианты уведомлений
+KB_NOTIFY_SETTINGS = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("Каждый час", callback_data='notify_hour'),
+        InlineKeyboardButton("Ежедневно (09:00)", callback_data='notify_day')
+    ],
+    [
+        InlineKeyboardButton("Трижды в день", callback_data='notify_day_multi'),
+        InlineKeyboardButton("Еженедельно (Пн)", callback_data='notify_week')
+    ],
+    [
+        InlineKeyboardButton("Настройка времени", callback_data='notify_custom'),
+        InlineKeyboardButton("Отключить", callback_data='notify_off')
+    ],
+    [
+        InlineKeyboardButton("« Назад", callback_data='settings')
+    ]
+])
+
+# Пользовательская настройка уведомлений
+KB_NOTIFY_CUSTOM = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("День и время", callback_data='notify_day_custom'),
+        InlineKeyboardButton("День недели", callback_data='notify_week_custom')
+    ],
+    [
+        InlineKeyboardButton("« Назад", callback_data='notify_settings')
+    ]
+])
+
+# Выбор дня недели
+KB_NOTIFY_WEEKDAYS = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("Понедельник", callback_data='notify_week_0'),
+        InlineKeyboardButton("Вторник", callback_data='notify_week_1')
+    ],
+    [
+        InlineKeyboardButton("Среда", callback_data='notify_week_2'),
+        InlineKeyboardButton("Четверг", callback_data='notify_week_3')
+    ],
+    [
+        InlineKeyboardButton("Пятница", callback_data='notify_week_4'),
+        InlineKeyboardButton("Суббота", callback_data='notify_week_5')
+    ],
+    [
+        InlineKeyboardButton("Воскресенье", callback_data='notify_week_6')
+    ],
+    [
+        InlineKeyboardButton("« Назад", callback_data='notify_custom')
+    ]
+])
+
+# Неизменные кнопки отмены в диалогах подтверждения (меняется только кнопка подтверждения)
+BTN_ADD_TIME_CANCEL = InlineKeyboardButton("Отмена", callback_data='add_time')
+BTN_TIMER_CANCEL = InlineKeyboardButton("Нет, отмена", callback_data='timer_cancel')
+BTN_TIMER_GROUP_CANCEL = InlineKeyboardButton("Отмена", callback_data='timer_cancel')
+
+class RateLimitedBot(ExtBot):
+    """Бот, ограничивающий частоту исходящих сообщений, чтобы не получать 429 от Telegram"""
+
+    # Не более 25 сообщений в секунду на весь бот (лимит Telegram - 30)
+    GLOBAL_LIMIT, GLOBAL_PERIOD = 25, 1.0
+    # В среднем не более 1 сообщения в секунду в один чат, допускаются короткие всплески
+    # (редактирование сообщений в этот лимит не входит)
+    CHAT_LIMIT, CHAT_PERIOD = 5, 5.0
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._rate_changed = threading.Condition()
+        self._global_sends = deque()
+        self._chat_sends = {}
+        # Очереди ожидающих отправки в чат: отправки выполняются в порядке поступления
+        self._chat_waiters = {}
+        self._last_prune = 0.0
+        self._paused_until = 0.0
+
+    def _wait_for_slot(self, chat_id, per_chat=True):
+        """Ожидание, пока отправка уложится в лимиты (в чат - в порядке очереди)"""
+        ticket = object()
+        with self._rate_changed:
+            if per_chat:
+                waiters = self._chat_waiters.setdefault(chat_id, deque())
+                waiters.append(ticket)
+
+            try:
+                while True:
+                    now = time.monotonic()
+
+                    # Раз в окно забываем чаты, все отметки которых вышли за окно
+                    if now - self._last_prune >= self.CHAT_PERIOD:
+                        self._last_prune = now
+                        stale = [cid for cid, sends in self._chat_sends.items()
+                                 if not sends or now - sends[-1] >= self.CHAT_PERIOD]
+                        for cid in stale:
+                            del self._chat_sends[cid]
+
+                    # Отбрасываем отметки, вышедшие за окно
+                    while self._global_sends and now - self._global_sends[0] >= self.GLOBAL_PERIOD:
+                        self._global_sends.popleft()
+
+                    wait = self._paused_until - now
+                    if len(self._global_sends) >= self.GLOBAL_LIMIT:
+                        wait = max(wait, self.GLOBAL_PERIOD - (now - self._global_sends[0]))
+
+                    if per_chat:
+                        chat_sends = self._chat_sends.setdefault(chat_id, deque())
+                        while chat_sends and now - chat_sends[0] >= self.CHAT_PERIOD:
+                            chat_sends.popleft()
+
+                        if waiters[0] is not ticket:
+                            # Ждем, пока отправят все, кто встал в очередь раньше
+                            self._rate_changed.wait()
+                            continue
+                        if len(chat_sends) >= self.CHAT_LIMIT:
+                            wait = max(wait, self.CHAT_PERIOD - (now - chat_sends[0]))
+
+                    if wait <= 0:
+                        self._global_sends.append(now)
+                        if per_chat:
+                            chat_sends.append(now)
+                        return
+
+                    self._rate_changed.wait(wait)
+            finally:
+                if per_chat:
+                    waiters.remove(ticket)
+                    if not waiters:
+                        del self._chat_waiters[chat_id]
+                    self._rate_changed.notify_all()
+
+    def _send_limited(self, chat_id, per_chat, method, /, *args, **kwargs):
+        """Вызов метода отправки с учетом лимитов и повтором после RetryAfter"""
+        self._wait_for_slot(chat_id, per_chat)
+        try:
+            return method(*args, **kwargs)
+        except RetryAfter as e:
+            # Telegram попросил подождать - приостанавливаем все отправки бота
+            logger.warning("Превышен лимит Telegram, пауза %s с", e.retry_after)
+            with self._rate_changed:
+                self._paused_until = max(self._paused_until, time.monotonic() + e.retry_after)
+
+            # Перематываем файлы (например, диаграмму), прочитанные первой попыткой
+            for value in list(args) + list(kwargs.values()):
+                if hasattr(value, 'seek'):
+                    value.seek(0)
+
+            self._wait_for_slot(chat_id, per_chat)
+            return method(*args, **kwargs)
+
+    def send_message(self, chat_id, *args, **kwargs):
+        return self._send_limited(chat_id, True, super().send_message, chat_id, *args, **kwargs)
+
+    def send_photo(self, chat_id, *args, **kwargs):
+        return self._send_limited(chat_id, True, super().send_photo, chat_id, *args, **kwargs)
+
+    def edit_message_text(self, *args, **kwargs):
+        # Редактирование существующего сообщения ограничено только общим лимитом бота
+        return self._send_limited(kwargs.get('chat_id'), False, super().edit_message_text, *args, **kwargs)
+
+    def delete_messages(self, chat_id, message_ids):
+        """Удаление нескольких сообщений одного чата одним запросом (метод Bot API deleteMessages)"""
+        return self._post('deleteMessages', {'chat_id': chat_id, 'message_ids': list(message_ids)})
+
+
 # Инициализация базы данных
 db = Database()
 
 # Инициализация планировщика
-scheduler = BackgroundScheduler()
+# (в нем одна ежеминутная задача рассылки, сами отправки идут через NOTIFY_POOL,
+# поэтому планировщику достаточно одного рабочего потока)
+scheduler = BackgroundScheduler(executors={'default': {'type': 'threadpool', 'max_workers': 1}})
 scheduler.start()
 
+# Сообщения, ожидающие автоудаления: куча (delete_at, chat_id, message_id)
+PENDING_DELETES = []
+PENDING_DELETES_LOCK = threading.Lock()
+
+# Короткие уведомления, ожидающие отправки одним сообщением: chat_id -> [(text, delete_after)]
+TOAST_BUFFERS = {}
+TOAST_BUFFERS_LOCK = threading.Lock()
+TOAST_DEBOUNCE = 0.5
+
+# Пул для параллельной рассылки уведомлений (общий лимит отправки соблюдает RateLimitedBot)
+NOTIFY_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix='notify')
+
+# Время уведомлений в режиме day_multi
+DAY_MULTI_TIMES = ((9, 0), (18, 0), (22, 0))
+
+# Последняя минута, за которую разосланы уведомления (UTC), и сколько пропущенных минут
+# досылается, если рассылка запустилась с опозданием
+LAST_NOTIFY_MINUTE = None
+MAX_NOTIFY_CATCHUP = 5
+
+# Псевдо-апдейт для обработки таймера из задачи (без исходного сообщения пользователя)
+PseudoUser = namedtuple('PseudoUser', 'id')
+PseudoMessage = namedtuple('PseudoMessage', 'chat_id')
+PseudoUpdate = namedtuple('PseudoUpdate', 'effective_user message')
+
+# Сроки обработки групп таймеров по монотонным часам: user_id -> (deadline, chat_id)
+GROUP_DEADLINES = {}
+GROUP_DEADLINES_CHANGED = threading.Condition()
+
+# Очереди задач пользователей для пула диспетчера: user_id -> deque((func, args, update)).
+# Задачи одного пользователя выполняются по одной в порядке поступления, разных - параллельно
+USER_QUEUES = {}
+USER_QUEUES_LOCK = threading.Lock()
+
+
+def is_timer_message(text):
+    """Проверка, является ли текст сообщением об остановке таймера"""
+    return len(text) >= TIMER_MESSAGE_MIN_LEN and TIMER_MESSAGE_RE.search(text) is not None
+
+
+def run_for_user(dispatcher, user_id, func, *args, update=None):
+    """Выполнение задачи в пуле диспетчера после всех ранее поставленных задач пользователя"""
+    with USER_QUEUES_LOCK:
+        queue = USER_QUEUES.get(user_id)
+        idle = queue is None
+        if idle:
+            queue = USER_QUEUES[user_id] = deque()
+        queue.append((func, args, update))
+
+    # Очередь разбирает один поток пула, пока она не опустеет
+    if idle:
+        dispatcher.run_async(_drain_user_queue, dispatcher, user_id)
+
+
+def _drain_user_queue(dispatcher, user_id):
+    """Последовательное выполнение задач пользователя из его очереди"""
+    while True:
+        with USER_QUEUES_LOCK:
+            queue = USER_QUEUES[user_id]
+            if not queue:
+                del USER_QUEUES[user_id]
+                return
+            func, args, update = queue.popleft()
+
+        try:
+            func(*args)
+        except Exception as e:
+            dispatcher.dispatch_error(update, e)
+
+
+def per_user(handler):
+    """Обработчик, выполняемый в пуле диспетчера строго по очереди для каждого пользователя"""
+    def wrapper(update, context):
+        run_for_user(context.dispatcher, update.effective_user.id, handler, update, context, update=update)
+    return wrapper
+
+
+def shutdown_hook():
+    """Функция, которая будет вызвана при завершении работы интерпретатора"""
+    logger.info("Завершение работы бота")
+    
+    # Останавливаем планировщик, если он запущен
+    try:
+        if scheduler and scheduler.running:
+            scheduler.shutdown(wait=False)
+            logger.info("Планировщик остановлен")
+    except Exception as e:
+        logger.error("Ошибка при остановке планировщика: %s", e)
+    
+    # Не ждем оставшиеся уведомления
+    NOTIFY_POOL.shutdown(wait=False)
 
-def send_notification(context: CallbackContext, user_id):
+
+# Регистрируем функцию очистки при завершении работы
+atexit.register(shutdown_hook)
+
+
+def send_notification(bot, user_id):
     """Отправка уведомления пользователю"""
-    progress = db.get_progress(user_id)
-    if progress:
-        message = format_notification_message(progress)
-        context.bot.send_message(chat_id=user_id, text=message)
-
-
-def setup_notification(context: CallbackContext, user_id, freq):
-    """Настройка периодичности уведомлений"""
-    # Удаляем существующие задачи для пользователя
-    for job in scheduler.get_jobs():
-        if job.id == f"notify_{user_id}":
-            job.remove()
-    
-    # Устанавливаем новую задачу
-    if freq == 'hour':
-        scheduler.add_job(
-            send_notification, 'interval', hours=1, id=f"notify_{user_id}",
-            args=(context, user_id), timezone=pytz.UTC
-        )
-    elif freq == 'day':
-        scheduler.add_job(
-            send_notification, 'interval', days=1, id=f"notify_{user_id}",
-            args=(context, user_id), timezone=pytz.UTC
-        )
-    elif freq == 'week':
-        scheduler.add_job(
-            send_notification, 'interval', weeks=1, id=f"notify_{user_id}",
-            args=(context, user_id), timezone=pytz.UTC
-        )
+    try:
+        progress = db.get_progress(user_id)
+        if progress:
+            message = format_notification_message(progress)
+            bot.send_message(chat_id=user_id, text=message)
+    except Exception as e:
+        logger.error("Ошибка при отправке уведомления пользователю %s: %s", user_id, e)
+
+
+def dispatch_notifications(bot):
+    """Ежеминутная рассылка уведомлений пользователям, у которых наступило время"""
+    global LAST_NOTIFY_MINUTE
+
+    # Запуск может опоздать и попасть в следующую минуту: рассылаем каждую минуту
+    # после последней разосланной ровно один раз, а не минуту по текущим часам
+    current = datetime.datetime.now(UTC).replace(second=0, microsecond=0)
+    step = datetime.timedelta(minutes=1)
+    if LAST_NOTIFY_MINUTE is None:
+        minute = current
+    else:
+        minute = max(LAST_NOTIFY_MINUTE + step, current - step * MAX_NOTIFY_CATCHUP)
+
+    while minute <= current:
+        # Ежечасные и day_multi уведомления не хранят время в базе
+        kinds = []
+        if minute.minute == 0:
+            kinds.append('hour')
+        if (minute.hour, minute.minute) in DAY_MULTI_TIMES:
+            kinds.append('day_multi')
+
+        for user_id in db.get_users_due(minute.hour, minute.minute, minute.weekday(), kinds):
+            NOTIFY_POOL.submit(send_notification, bot, user_id)
+
+        LAST_NOTIFY_MINUTE = minute
+        minute += step
 
 
 # Функции обработчики команд
@@ -107,15 +506,14 @@ def rate_input(update: Update, context: CallbackContext) -> int:
     # Сохраняем текущее состояние в контексте пользователя
     context.user_data['state'] = RATE
     
-    logger.info(f"Получен ввод ставки от пользователя {user_id}: '{user_input}'")
+    logger.info("Получен ввод ставки от пользователя %s: '%s'", user_id, user_input)
     
     # Проверяем, не является ли это сообщением таймера
-    if "таймер остановлен" in user_input.lower() and "затрачено" in user_input.lower():
-        logger.info(f"Обнаружено сообщение таймера в состоянии RATE, обрабатываем напрямую")
+    if is_timer_message(user_input):
+        logger.info("Обнаружено сообщение таймера в состоянии RATE, обрабатываем напрямую")
         
         # Очищаем состояние пользователя
-        if 'state' in context.user_data:
-            del context.user_data['state']
+        context.user_data.pop('state', None)
             
         # Парсим время из сообщения таймера
         minutes = parse_timer_message(user_input)
@@ -135,16 +533,17 @@ def rate_input(update: Update, context: CallbackContext) -> int:
     # Пытаемся получить числовое значение ставки
     try:
         # Очищаем ввод от лишних символов
-        rate_text = user_input.replace('₽', '').replace('р', '').replace('руб', '')
-        rate_text = rate_text.replace(',', '.').strip()
+        rate_text = CURRENCY_RE.sub('', user_input).replace(',', '.').strip()
         
-        logger.info(f"Очищенный текст ставки: '{rate_text}'")
+        logger.info("Очищенный текст ставки: '%s'", rate_text)
         
         rate = float(rate_text)
+        if not math.isfinite(rate):
+            raise ValueError(f"Недопустимое значение: {rate_text}")
         
         # Сохраняем временно в контексте
         context.user_data['rate'] = rate
-        logger.info(f"Ставка сохранена в контексте: {rate}")
+        logger.info("Ставка сохранена в контексте: %s", rate)
         
         update.message.reply_text(
             f"Отлично! Ваша почасовая ставка: {rate:.0f}₽\n\n"
@@ -154,7 +553,7 @@ def rate_input(update: Update, context: CallbackContext) -> int:
         return GOAL
     
     except ValueError as e:
-        logger.error(f"Ошибка преобразования ставки: {e}")
+        logger.error("Ошибка преобразования ставки: %s", e)
         update.message.reply_text(
             "Пожалуйста, введите корректное числовое значение для почасовой ставки.\n"
             "Например: 500 или 500₽"
@@ -171,15 +570,14 @@ def goal_input(update: Update, context: CallbackContext) -> int:
     # Сохраняем текущее состояние в контексте пользователя
     context.user_data['state'] = GOAL
     
-    logger.info(f"Получен ввод цели от пользователя {user_id}: '{user_input}'")
+    logger.info("Получен ввод цели от пользователя %s: '%s'", user_id, user_input)
     
     # Проверяем, не является ли это сообщением таймера
-    if "таймер остановлен" in user_input.lower() and "затрачено" in user_input.lower():
-        logger.info(f"Обнаружено сообщение таймера в состоянии GOAL, обрабатываем напрямую")
+    if is_timer_message(user_input):
+        logger.info("Обнаружено сообщение таймера в состоянии GOAL, обрабатываем напрямую")
         
         # Очищаем состояние пользователя
-        if 'state' in context.user_data:
-            del context.user_data['state']
+        context.user_data.pop('state', None)
             
         # Парсим время из сообщения таймера
         minutes = parse_timer_message(user_input)
@@ -199,17 +597,18 @@ def goal_input(update: Update, context: CallbackContext) -> int:
     # Пытаемся получить числовое значение цели
     try:
         # Очищаем ввод от лишних символов
-        goal_text = user_input.replace('₽', '').replace('р', '').replace('руб', '')
-        goal_text = goal_text.replace(',', '.').strip()
+        goal_text = CURRENCY_RE.sub('', user_input).replace(',', '.').strip()
         
-        logger.info(f"Очищенный текст цели: '{goal_text}'")
+        logger.info("Очищенный текст цели: '%s'", goal_text)
         
         goal = float(goal_text)
+        if not math.isfinite(goal):
+            raise ValueError(f"Недопустимое значение: {goal_text}")
         
         # Получаем сохраненную ставку из контекста
         rate = context.user_data.get('rate')
         
-        logger.info(f"Полученная из контекста ставка: {rate}")
+        logger.info("Полученная из контекста ставка: %s", rate)
         
         if rate is None:
             update.message.reply_text(
@@ -220,21 +619,14 @@ def goal_input(update: Update, context: CallbackContext) -> int:
         # Сохраняем пользователя в базу данных
         try:
             db.add_user(user_id, rate, goal)
-            logger.info(f"Пользователь {user_id} добавлен в базу данных")
+            logger.info("Пользователь %s добавлен в базу данных", user_id)
         except Exception as e:
-            logger.error(f"Ошибка при добавлении пользователя в БД: {e}")
+            logger.error("Ошибка при добавлении пользователя в БД: %s", e)
             update.message.reply_text(
                 "Произошла ошибка при сохранении данных. Пожалуйста, попробуйте позже."
             )
             return ConversationHandler.END
         
-        # Настройка уведомлений (по умолчанию ежедневно)
-        try:
-            setup_notification(context, user_id, 'day')
-            logger.info(f"Настроены уведомления для пользователя {user_id}")
-        except Exception as e:
-            logger.error(f"Ошибка при настройке уведомлений: {e}")
-        
         update.message.reply_text(
             f"Отлично! Ваша цель заработка: {goal:.0f}₽\n\n"
             f"Настройка завершена, теперь вы можете использовать бот для отслеживания времени."
@@ -246,7 +638,7 @@ def goal_input(update: Update, context: CallbackContext) -> int:
         return ConversationHandler.END
     
     except ValueError as e:
-        logger.error(f"Ошибка преобразования цели: {e}")
+        logger.error("Ошибка преобразования цели: %s", e)
         update.message.reply_text(
             "Пожалуйста, введите корректное числовое значение для цели заработка.\n"
             "Например: 50000 или 50000₽"
@@ -295,35 +687,21 @@ def show_main_menu(update: Update, context: CallbackContext):
     else:
         menu_text = "Главное меню:"
     
-    # Создаем клавиатуру (убираем кнопку "Мой прогресс")
-    keyboard = [
-        [
-            InlineKeyboardButton("Добавить время", callback_data='add_time')
-        ],
-        [
-            InlineKeyboardButton("История", callback_data='history'),
-            InlineKeyboardButton("Настройки", callback_data='settings')
-        ]
-    ]
-    
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = KB_MAIN_MENU
     
     # Отправляем сообщение с главным меню (не редактируем старое)
     message = None
     
     try:
         # Пытаемся удалить предыдущее сообщение, если оно существует
-        if 'last_bot_message' in context.user_data:
+        last_bot_message = context.user_data.pop('last_bot_message', None)
+        if last_bot_message:
             try:
-                chat_id, message_id = context.user_data['last_bot_message']
+                chat_id, message_id = last_bot_message
                 context.bot.delete_message(chat_id=chat_id, message_id=message_id)
-                logger.info(f"Успешно удалено предыдущее сообщение бота: {message_id}")
-                # Очищаем ссылку на удаленное сообщение
-                del context.user_data['last_bot_message']
+                logger.info("Успешно удалено предыдущее сообщение бота: %s", message_id)
             except Exception as e:
-                logger.error(f"Не удалось удалить предыдущее сообщение бота: {e}")
-                # Очищаем ссылку на недоступное сообщение
-                del context.user_data['last_bot_message']
+                logger.error("Не удалось удалить предыдущее сообщение бота: %s", e)
         
         # Создаем диаграмму прогресса, если есть данные прогресса
         if progress:
@@ -382,10 +760,10 @@ def show_main_menu(update: Update, context: CallbackContext):
         if message:
             context.user_data['last_bot_message'] = (message.chat_id, message.message_id)
             context.user_data['user_chat_id'] = message.chat_id
-            logger.info(f"Показано главное меню, ID сообщения: {message.message_id}")
+            logger.info("Показано главное меню, ID сообщения: %s", message.message_id)
             
     except Exception as e:
-        logger.error(f"Ошибка при отображении главного меню: {e}")
+        logger.error("Ошибка при отображении главного меню: %s", e)
         # Пытаемся уведомить пользователя о проблеме
         try:
             if update.callback_query and update.callback_query.message:
@@ -396,1050 +774,638 @@ def show_main_menu(update: Update, context: CallbackContext):
             pass
 
 
-def button_callback(update: Update, context: CallbackContext) -> int:
-    """Обработка нажатий на кнопки меню"""
-    query = update.callback_query
-    user_id = update.effective_user.id
-    
+def replace_prompt(query, context, text, reply_markup=None):
+    """Замена сообщения с кнопками новым текстом одним запросом к Telegram"""
+    message = None
+    # Сообщение с фото (главное меню с диаграммой) не превратить в текстовое - сразу удаляем и отправляем новое
+    if query.message.text is not None and not query.message.photo:
+        try:
+            message = query.edit_message_text(text=text, reply_markup=reply_markup)
+        except BadRequest as e:
+            if 'message is not modified' in str(e).lower():
+                message = query.message
+            else:
+                # Сообщение нельзя отредактировать (слишком старое) - удаляем и отправляем новое
+                logger.info("Не удалось отредактировать сообщение, отправляем новое: %s", e)
+
+    if message is None:
+        try:
+            query.message.delete()
+        except Exception as e:
+            logger.error("Не удалось удалить сообщение: %s", e)
+
+        message = context.bot.send_message(
+            chat_id=query.message.chat_id,
+            text=text,
+            reply_markup=reply_markup
+        )
+
+    # Сохраняем ID сообщения, чтобы удалить его при следующем показе меню
+    if message:
+        context.user_data['last_bot_message'] = (message.chat_id, message.message_id)
+    return message
+
+
+def replace_with_notice(query, context, text, delete_seconds=5):
+    """Замена сообщения с кнопками временным уведомлением с автоудалением"""
+    message = replace_prompt(query, context, text)
+
+    # Уведомление удалится по таймеру, главное меню не должно удалять его раньше
+    context.user_data.pop('last_bot_message', None)
+
+    delete_message_later(message.chat_id, message.message_id, delete_seconds)
+    return message
+
+
+def _bail(update, context, chat_id, log_msg, exc, text="Произошла ошибка. Пожалуйста, попробуйте позже."):
+    """Логирование ошибки обработчика кнопки, сообщение пользователю и возврат в главное меню"""
+    logger.error("%s: %s", log_msg, exc)
+    context.bot.send_message(chat_id=chat_id, text=text)
+    show_main_menu(update, context)
+
+
+# Маршруты кнопок: точные значения callback_data и префиксы для кнопок с параметрами
+# (префиксы проверяются после точных совпадений)
+CB_ROUTES = {}
+CB_PREFIX_ROUTES = []
+
+
+def register(*callback_data, prefixes=()):
+    """Регистрация обработчика кнопки для указанных callback_data и префиксов"""
+    def decorator(handler):
+        for value in callback_data:
+            CB_ROUTES[value] = handler
+        for prefix in prefixes:
+            CB_PREFIX_ROUTES.append((prefix, handler))
+        return handler
+    return decorator
+
+
+@register('main_menu')
+def _cb_main_menu(update, context, query, user_id, chat_id, data, parts):
+    """Кнопка «Главное меню»"""
+    show_main_menu(update, context)
+    return ConversationHandler.END
+
+
+@register('add_time')
+def _cb_add_time(update, context, query, user_id, chat_id, data, parts):
+    """Показываем кнопки быстрого добавления времени"""
+    reply_markup = KB_ADD_TIME
+
     try:
-        query.answer()
+        replace_prompt(
+            query, context,
+            text="Выберите время или введите вручную:",
+            reply_markup=reply_markup
+        )
     except Exception as e:
-        logger.error(f"Не удалось ответить на callback_query: {e}")
-    
-    data = query.data
-    chat_id = query.message.chat_id
-    
-    # Сохраняем chat_id для последующего использования
-    context.user_data['user_chat_id'] = chat_id
-    
-    logger.info(f"Обработка кнопки: {data} от пользователя {user_id}")
-    
-    if data == 'main_menu':
+        logger.error("Ошибка при отображении меню добавления времени: %s", e)
         show_main_menu(update, context)
         return ConversationHandler.END
-    
-    elif data == 'add_time':
-        # Показываем кнопки быстрого добавления времени
-        keyboard = [
-            [
-                InlineKeyboardButton("15 мин", callback_data='time_15'),
-                InlineKeyboardButton("30 мин", callback_data='time_30')
-            ],
-            [
-                InlineKeyboardButton("1 час", callback_data='time_60'),
-                InlineKeyboardButton("2 часа", callback_data='time_120')
-            ],
-            [
-                InlineKeyboardButton("Ввести вручную", callback_data='time_manual')
-            ],
-            [
-                InlineKeyboardButton("« Назад", callback_data='main_menu')
-            ]
-        ]
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        try:
-            # Удаляем предыдущее сообщение и отправляем новое
-            try:
-                query.message.delete()
-            except Exception as e:
-                logger.error(f"Не удалось удалить сообщение: {e}")
-                
-            message = context.bot.send_message(
+
+    return ADD_TIME
+
+
+@register('time_manual')
+def _cb_time_manual(update, context, query, user_id, chat_id, data, parts):
+    """Запрос ручного ввода времени"""
+    try:
+        # Следующее текстовое сообщение пользователя будет обработано как ввод времени
+        context.user_data['state'] = CONFIRM_TIME
+        logger.info("Установлено состояние CONFIRM_TIME для пользователя %s", user_id)
+
+        replace_prompt(
+            query, context,
+            text="Введите время в одном из форматов:\n"
+            "• 2ч 20м\n"
+            "• 140мин\n"
+            "• 2.33 (часы)"
+        )
+    except Exception as e:
+        logger.error("Ошибка при отображении формата ввода времени: %s", e)
+        show_main_menu(update, context)
+        return ConversationHandler.END
+
+    return CONFIRM_TIME
+
+
+@register(prefixes=('time_',))
+def _cb_time_quick(update, context, query, user_id, chat_id, data, parts):
+    """Предпросмотр быстрого добавления времени (например, time_15 -> 15 минут)"""
+    minutes = int(parts[1])
+
+    try:
+        # Получаем данные пользователя
+        user_data = db.get_user_data(user_id)
+        if not user_data:
+            context.bot.send_message(
                 chat_id=chat_id,
-                text="Выберите время или введите вручную:",
-                reply_markup=reply_markup
+                text="Не удалось получить данные пользователя. Используйте /start для настройки."
             )
-            
-            # Сохраняем ID сообщения
-            if message:
-                context.user_data['last_bot_message'] = (message.chat_id, message.message_id)
-        except Exception as e:
-            logger.error(f"Ошибка при отображении меню добавления времени: {e}")
-            show_main_menu(update, context)
             return ConversationHandler.END
-        
-        return ADD_TIME
-    
-    elif data.startswith('time_'):
-        if data == 'time_manual':
-            try:
-                # Удаляем предыдущее сообщение и отправляем новое
-                try:
-                    query.message.delete()
-                except Exception as e:
-                    logger.error(f"Не удалось удалить сообщение: {e}")
-                    
-                message = context.bot.send_message(
-                    chat_id=chat_id,
-                    text="Введите время в одном из форматов:\n"
-                    "• 2ч 20м\n"
-                    "• 140мин\n"
-                    "• 2.33 (часы)"
-                )
-                
-                # Сохраняем ID сообщения
-                if message:
-                    context.user_data['last_bot_message'] = (message.chat_id, message.message_id)
-            except Exception as e:
-                logger.error(f"Ошибка при отображении формата ввода времени: {e}")
-                show_main_menu(update, context)
-                return ConversationHandler.END
-                
-            return CONFIRM_TIME
-        else:
-            # Получаем минуты из data (например, time_15 -> 15 минут)
-            minutes = int(data.split('_')[1])
-            
-            try:
-                # Получаем данные пользователя
-                user_data = db.get_user_data(user_id)
-                if not user_data:
-                    context.bot.send_message(
-                        chat_id=chat_id,
-                        text="Не удалось получить данные пользователя. Используйте /start для настройки."
-                    )
-                    return ConversationHandler.END
-                    
-                rate = user_data['rate']
-                
-                # Расчет заработка
-                earnings = (minutes / 60) * rate
-                
-                # Предпросмотр добавления
-                keyboard = [
-                    [
-                        InlineKeyboardButton("Подтвердить", callback_data=f'confirm_{minutes}'),
-                        InlineKeyboardButton("Отмена", callback_data='add_time')
-                    ]
-                ]
-                
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                
-                # Удаляем предыдущее сообщение и отправляем новое
-                try:
-                    query.message.delete()
-                except Exception as e:
-                    logger.error(f"Не удалось удалить сообщение: {e}")
-                    
-                message = context.bot.send_message(
-                    chat_id=chat_id,
-                    text=f"Вы хотите добавить: {format_time(minutes)}\n"
-                    f"Заработок: {format_money(earnings)}\n\n"
-                    f"Подтвердите добавление:",
-                    reply_markup=reply_markup
-                )
-                
-                # Сохраняем ID сообщения
-                if message:
-                    context.user_data['last_bot_message'] = (message.chat_id, message.message_id)
-            except Exception as e:
-                logger.error(f"Ошибка при расчете заработка: {e}")
-                context.bot.send_message(
-                    chat_id=chat_id,
-                    text="Произошла ошибка при расчете заработка. Пожалуйста, попробуйте снова."
-                )
-                show_main_menu(update, context)
-                return ConversationHandler.END
-                
-            return CONFIRM_TIME
-    
-    elif data.startswith('confirm_'):
-        # Получаем минуты из data (например, confirm_15 -> 15 минут)
-        minutes = int(data.split('_')[1])
-        
+
+        rate = user_data['rate']
+
+        # Расчет заработка
+        earnings = (minutes / 60) * rate
+
+        # Предпросмотр добавления
+        reply_markup = InlineKeyboardMarkup([[
+            InlineKeyboardButton("Подтвердить", callback_data=f'confirm_{minutes}'),
+            BTN_ADD_TIME_CANCEL
+        ]])
+
+        replace_prompt(
+            query, context,
+            text=f"Вы хотите добавить: {format_time(minutes)}\n"
+            f"Заработок: {format_money(earnings)}\n\n"
+            f"Подтвердите добавление:",
+            reply_markup=reply_markup
+        )
+    except Exception as e:
+        _bail(
+            update, context, chat_id, "Ошибка при расчете заработка", e,
+            "Произошла ошибка при расчете заработка. Пожалуйста, попробуйте снова."
+        )
+        return ConversationHandler.END
+
+    return CONFIRM_TIME
+
+
+@register(prefixes=('confirm_',))
+def _cb_confirm_time(update, context, query, user_id, chat_id, data, parts):
+    """Подтверждение добавления времени (например, confirm_15 -> 15 минут)"""
+    minutes = int(parts[1])
+
+    try:
+        # Добавляем запись в базу данных
+        earnings = db.add_time_record(user_id, minutes)
+
+        # Заменяем сообщение с кнопками временным сообщением с подтверждением
+        replace_with_notice(
+            query, context,
+            f"✅\nВремя добавлено: {format_time(minutes)}\n"
+            f"Заработано: {format_money(earnings)}"
+        )
+
+        # Показываем обновленное главное меню
+        show_main_menu(update, context)
+    except Exception as e:
+        logger.error("Ошибка при обработке подтверждения времени: %s", e)
         try:
-            # Добавляем запись в базу данных
-            earnings = db.add_time_record(user_id, minutes)
-            
-            # Сначала пытаемся удалить сообщение с кнопками
-            try:
-                query.message.delete()
-            except Exception as e:
-                logger.error(f"Не удалось удалить сообщение с кнопками: {e}")
-            
-            # Отправляем новое сообщение с подтверждением
-            message = query.message.reply_text(
-                f"✅\nВремя добавлено: {format_time(minutes)}\n"
-                f"Заработано: {format_money(earnings)}"
-            )
-            
-            # Планируем удаление сообщения
-            context.job_queue.run_once(
-                delete_message_later, 
-                5, 
-                context=(message.chat_id, message.message_id)
+            query.message.reply_text(
+                "Произошла ошибка при добавлении времени. Пожалуйста, попробуйте снова."
             )
-            
-            # Показываем обновленное главное меню
-            show_main_menu(update, context)
-        except Exception as e:
-            logger.error(f"Ошибка при обработке подтверждения времени: {e}")
-            try:
-                query.message.reply_text(
-                    "Произошла ошибка при добавлении времени. Пожалуйста, попробуйте снова."
-                )
-            except:
-                pass
-        
-        return ConversationHandler.END
-    
-    elif data == 'progress':
-        # Получаем прогресс пользователя
-        progress = db.get_progress(user_id)
-        
-        if progress:
-            # Создаем диаграмму прогресса
-            chart_buf = create_progress_chart(progress)
-            
-            # Отправляем диаграмму как фото
-            query.message.reply_photo(
-                photo=chart_buf,
-                caption=f"Ваш прогресс: {progress['percent']}% от цели"
-            )
-            
-            # Возвращаемся в главное меню
-            show_main_menu(update, context)
+        except:
+            pass
+
+    return ConversationHandler.END
+
+
+@register('progress')
+def _cb_progress(update, context, query, user_id, chat_id, data, parts):
+    """Отправка диаграммы прогресса"""
+    progress = db.get_progress(user_id)
+
+    if progress:
+        # Создаем диаграмму прогресса
+        chart_buf = create_progress_chart(progress)
+
+        # Отправляем диаграмму как фото
+        query.message.reply_photo(
+            photo=chart_buf,
+            caption=f"Ваш прогресс: {progress['percent']}% от цели"
+        )
+
+        # Возвращаемся в главное меню
+        show_main_menu(update, context)
+    else:
+        query.edit_message_text(
+            "Произошла ошибка при получении данных о прогрессе."
+        )
+
+
+@register('history')
+def _cb_history(update, context, query, user_id, chat_id, data, parts):
+    """Отображение истории записей"""
+    try:
+        records = db.get_time_history(user_id)
+
+        if records:
+            message_text = "📋 История:\n\n"
+            for record in records:
+                message_text += format_time_record(record) + "\n"
         else:
-            query.edit_message_text(
-                "Произошла ошибка при получении данных о прогрессе."
-            )
-    
-    elif data == 'history':
-        # Получаем историю записей
-        try:
-            records = db.get_time_history(user_id)
-            
-            if records:
-                message_text = "📋 История:\n\n"
-                for record in records:
-                    message_text += format_time_record(record) + "\n"
-            else:
-                message_text = "История пуста."
-            
-            keyboard = [
-                [InlineKeyboardButton("« Назад", callback_data='main_menu')]
-            ]
-            
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            # Удаляем предыдущее сообщение и отправляем новое
-            try:
-                query.message.delete()
-            except Exception as e:
-                logger.error(f"Не удалось удалить сообщение: {e}")
-                
-            message = context.bot.send_message(
-                chat_id=chat_id,
-                text=message_text,
-                reply_markup=reply_markup
-            )
-            
-            # Сохраняем ID сообщения
-            if message:
-                context.user_data['last_bot_message'] = (message.chat_id, message.message_id)
-        except Exception as e:
-            logger.error(f"Ошибка при получении истории: {e}")
-            context.bot.send_message(
-                chat_id=chat_id,
-                text="Произошла ошибка при получении истории. Пожалуйста, попробуйте позже."
-            )
-            show_main_menu(update, context)
-    
-    elif data == 'settings':
-        # Меню настроек
-        try:
-            keyboard = [
-                [
-                    InlineKeyboardButton("Изменить ставку", callback_data='change_rate'),
-                    InlineKeyboardButton("Изменить цель", callback_data='change_goal')
-                ],
-                [
-                    InlineKeyboardButton("Уведомления", callback_data='notifications'),
-                    InlineKeyboardButton("Сбросить прогресс", callback_data='reset_goal')
-                ],
-                [
-                    InlineKeyboardButton("« Назад", callback_data='main_menu')
-                ]
-            ]
-            
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            # Удаляем предыдущее сообщение и отправляем новое
-            try:
-                query.message.delete()
-            except Exception as e:
-                logger.error(f"Не удалось удалить сообщение: {e}")
-                
-            message = context.bot.send_message(
-                chat_id=chat_id,
-                text="Настройки:",
-                reply_markup=reply_markup
-            )
-            
-            # Сохраняем ID сообщения
-            if message:
-                context.user_data['last_bot_message'] = (message.chat_id, message.message_id)
-        except Exception as e:
-            logger.error(f"Ошибка при отображении настроек: {e}")
-            show_main_menu(update, context)
-    
-    elif data == 'change_rate':
-        # Запрос новой ставки
-        try:
-            # Устанавливаем состояние в контексте пользователя
-            context.user_data['state'] = CHANGE_RATE
-            logger.info(f"Установлено состояние CHANGE_RATE для пользователя {user_id}")
-            
-            # Удаляем предыдущее сообщение и отправляем новое
-            try:
-                query.message.delete()
-            except Exception as e:
-                logger.error(f"Не удалось удалить сообщение: {e}")
-                
-            message = context.bot.send_message(
-                chat_id=chat_id,
-                text="Введите новую почасовую ставку:"
-            )
-            
-            # Сохраняем ID сообщения
-            if message:
-                context.user_data['last_bot_message'] = (message.chat_id, message.message_id)
-                
-            return CHANGE_RATE
-        except Exception as e:
-            logger.error(f"Ошибка при запросе новой ставки: {e}")
-            show_main_menu(update, context)
-            return ConversationHandler.END
-    
-    elif data == 'change_goal':
-        # Запрос новой цели
-        try:
-            # Устанавливаем состояние в контексте пользователя
-            context.user_data['state'] = CHANGE_GOAL
-            logger.info(f"Установлено состояние CHANGE_GOAL для пользователя {user_id}")
-            
-            # Удаляем предыдущее сообщение и отправляем новое
-            try:
-                query.message.delete()
-            except Exception as e:
-                logger.error(f"Не удалось удалить сообщение: {e}")
-                
-            message = context.bot.send_message(
-                chat_id=chat_id,
-                text="Введите новую цель заработка:"
-            )
-            
-            # Сохраняем ID сообщения
-            if message:
-                context.user_data['last_bot_message'] = (message.chat_id, message.message_id)
-                
-            return CHANGE_GOAL
-        except Exception as e:
-            logger.error(f"Ошибка при запросе новой цели: {e}")
-            show_main_menu(update, context)
-            return ConversationHandler.END
-    
-    elif data == 'notifications':
-        # Настройка уведомлений
-        try:
-            keyboard = [
-                [
-                    InlineKeyboardButton("Каждый час", callback_data='notify_hour'),
-                    InlineKeyboardButton("Ежедневно", callback_data='notify_day')
-                ],
-                [
-                    InlineKeyboardButton("Еженедельно", callback_data='notify_week'),
-                    InlineKeyboardButton("Отключить", callback_data='notify_off')
-                ],
-                [
-                    InlineKeyboardButton("« Назад", callback_data='settings')
-                ]
-            ]
-            
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            # Удаляем предыдущее сообщение и отправляем новое
-            try:
-                query.message.delete()
-            except Exception as e:
-                logger.error(f"Не удалось удалить сообщение: {e}")
-                
-            message = context.bot.send_message(
-                chat_id=chat_id,
-                text="Настройка уведомлений:",
-                reply_markup=reply_markup
-            )
-            
-            # Сохраняем ID сообщения
-            if message:
-                context.user_data['last_bot_message'] = (message.chat_id, message.message_id)
-        except Exception as e:
-            logger.error(f"Ошибка при отображении настроек уведомлений: {e}")
-            show_main_menu(update, context)
-    
-    elif data.startswith('notify_'):
-        freq = data.split('_')[1]
-        
-        try:
-            # Обработка нажатия на кнопку "Ежедневно" - показываем выбор времени
-            if freq == 'day' and len(data.split('_')) <= 2:
-                # Показываем инлайн клавиатуру с выбором времени
-                keyboard = [
-                    [
-                        InlineKeyboardButton("09:00", callback_data='notify_day_time_9_00'),
-                        InlineKeyboardButton("12:00", callback_data='notify_day_time_12_00'),
-                    ],
-                    [
-                        InlineKeyboardButton("15:00", callback_data='notify_day_time_15_00'),
-                        InlineKeyboardButton("18:00", callback_data='notify_day_time_18_00'),
-                    ],
-                    [
-                        InlineKeyboardButton("21:00", callback_data='notify_day_time_21_00'),
-                        InlineKeyboardButton("23:00", callback_data='notify_day_time_23_00'),
-                    ],
-                    [
-                        InlineKeyboardButton("Своё время", callback_data='notify_day_custom'),
-                        InlineKeyboardButton("« Назад", callback_data='notify_settings')
-                    ]
-                ]
-                
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                
-                # Удаляем предыдущее сообщение и отправляем новое
-                try:
-                    query.message.delete()
-                except Exception as e:
-                    logger.error(f"Не удалось удалить сообщение: {e}")
-                
-                message = context.bot.send_message(
-                    chat_id=chat_id,
-                    text="Выберите время для ежедневных уведомлений:",
-                    reply_markup=reply_markup
-                )
-                
-                # Сохраняем ID сообщения
-                if message:
-                    context.user_data['last_bot_message'] = (message.chat_id, message.message_id)
-                return
-            
-            # Обработка выбора конкретного времени для ежедневных уведомлений
-            elif freq == 'day' and len(data.split('_')) > 2 and data.split('_')[2] == 'time':
-                # Получаем время из callback_data (например, notify_day_time_9_00 -> 9:00)
-                hour = int(data.split('_')[3])
-                minute = int(data.split('_')[4])
-                time_str = f"{hour:02d}:{minute:02d}"
-                
-                # Удаляем существующие задачи для пользователя
-                for job in scheduler.get_jobs():
-                    if job.id.startswith(f"notify_{user_id}"):
-                        job.remove()
-                
-                # Настраиваем ежедневное уведомление в указанное время
-                scheduler.add_job(
-                    send_notification, 'cron', hour=hour, minute=minute, id=f"notify_{user_id}_day",
-                    args=(context, user_id), timezone=pytz.UTC
-                )
-                
-                # Обновляем настройку в базе данных
-                db.update_notify_freq(user_id, f"day_{time_str}")
-                
-                freq_text = f"ежедневно в {time_str}"
-            
-            # Обработка еженедельных уведомлений с выбором дня недели
-            elif freq == 'week' and len(data.split('_')) > 2:
-                day_of_week = int(data.split('_')[2])
-                
-                # Удаляем все задачи для пользователя
-                for job in scheduler.get_jobs():
-                    if job.id.startswith(f"notify_{user_id}"):
-                        job.remove()
-                
-                # Настраиваем еженедельное уведомление в указанный день недели
-                scheduler.add_job(
-                    send_notification, 'cron', day_of_week=day_of_week, hour=9, minute=0,
-                    id=f"notify_{user_id}_week",
-                    args=(context, user_id), timezone=pytz.UTC
-                )
-                
-                # Обновляем настройку в базе данных
-                db.update_notify_freq(user_id, f"week_{day_of_week}")
-                
-                # Преобразование числового дня недели в название
-                day_names = ["понедельник", "вторник", "среду", "четверг", "пятницу", "субботу", "воскресенье"]
-                day_name = day_names[day_of_week]
-                
-                freq_text = f"еженедельно в {day_name}"
-            
-            # Обработка отключения уведомлений
-            elif freq == 'off':
-                # Удаляем все задачи для пользователя
-                for job in scheduler.get_jobs():
-                    if job.id.startswith(f"notify_{user_id}"):
-                        job.remove()
-                
-                # Обновляем настройку в базе данных
-                db.update_notify_freq(user_id, 'off')
-                
-                freq_text = "отключены"
-            elif freq == 'day_multi':
-                # Удаляем существующие задачи для пользователя
-                for job in scheduler.get_jobs():
-                    if job.id.startswith(f"notify_{user_id}"):
-                        job.remove()
-                
-                # Фиксированные времена для уведомлений
-                times = [
-                    (9, 0),   # 09:00
-                    (18, 0),  # 18:00
-                    (22, 0)   # 22:00
-                ]
-                
-                # Настраиваем уведомления на каждое время
-                for i, (hour, minute) in enumerate(times):
-                    scheduler.add_job(
-                        send_notification, 'cron', hour=hour, minute=minute,
-                        id=f"notify_{user_id}_daily_{i}",
-                        args=(context, user_id), timezone=pytz.UTC
-                    )
-                
-                # Обновляем настройку в базе данных
-                db.update_notify_freq(user_id, "day_multi")
-                
-                freq_text = "ежедневно в 09:00, 18:00 и 22:00"
-            else:
-                # Настраиваем уведомления с указанной частотой
-                setup_notification(context, user_id, freq)
-                
-                # Обновляем настройку в базе данных
-                db.update_notify_freq(user_id, freq)
-                
-                freq_text = {
-                    'hour': 'ежечасно',
-                    'day': 'ежедневно в 09:00',
-                    'week': 'еженедельно в понедельник'
-                }.get(freq, freq)
-            
-            # Удаляем предыдущее сообщение и отправляем новое
-            try:
-                query.message.delete()
-            except Exception as e:
-                logger.error(f"Не удалось удалить сообщение: {e}")
-            
-            keyboard = [
-                [InlineKeyboardButton("« Назад", callback_data='settings')]
-            ]
-            
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            message = context.bot.send_message(
-                chat_id=chat_id,
-                text=f"Уведомления будут приходить {freq_text}.",
-                reply_markup=reply_markup
-            )
-            
-            # Сохраняем ID сообщения
-            if message:
-                context.user_data['last_bot_message'] = (message.chat_id, message.message_id)
-        except Exception as e:
-            logger.error(f"Ошибка при настройке уведомлений: {e}")
-            context.bot.send_message(
-                chat_id=chat_id,
-                text="Произошла ошибка при настройке уведомлений. Пожалуйста, попробуйте позже."
-            )
-            show_main_menu(update, context)
-    
-    elif data.startswith('timer_confirm_'):
-        # Получаем минуты из data
-        minutes = int(data.split('_')[2])
-        
-        try:
-            # Добавляем запись в базу данных
-            earnings = db.add_time_record(user_id, minutes)
-            
-            # Сначала пытаемся удалить сообщение с кнопками
-            try:
-                query.message.delete()
-            except Exception as e:
-                logger.error(f"Не удалось удалить сообщение с кнопками: {e}")
-            
-            # Отправляем новое сообщение с подтверждением
-            message = query.message.reply_text(
-                f"✅ Время из таймера добавлено: {format_time(minutes)}\n"
-                f"Заработано: {format_money(earnings)}"
-            )
-            
-            # Планируем удаление сообщения
-            context.job_queue.run_once(
-                delete_message_later, 
-                5, 
-                context=(message.chat_id, message.message_id)
-            )
-            
-            # Обновляем главное меню
-            show_main_menu(update, context)
-        except Exception as e:
-            logger.error(f"Ошибка при обработке подтверждения таймера: {e}")
-            try:
-                query.message.reply_text(
-                    "Произошла ошибка при добавлении времени. Пожалуйста, попробуйте снова."
-                )
-            except:
-                pass
-            
-        return ConversationHandler.END
-    
-    elif data.startswith('timer_group_confirm_'):
-        # Получаем общее количество минут из data
-        minutes = int(data.split('_')[3])
-        
-        try:
-            # Добавляем запись в базу данных
-            earnings = db.add_time_record(user_id, minutes)
-            
-            # Сначала пытаемся удалить сообщение с кнопками
-            try:
-                query.message.delete()
-            except Exception as e:
-                logger.error(f"Не удалось удалить сообщение с кнопками: {e}")
-            
-            # Отправляем новое сообщение с подтверждением
-            message = query.message.reply_text(
-                f"✅ Добавлено общее время из таймеров: {format_time(minutes)}\n"
-                f"Заработано: {format_money(earnings)}"
-            )
-            
-            # Планируем удаление сообщения
-            context.job_queue.run_once(
-                delete_message_later, 
-                5, 
-                context=(message.chat_id, message.message_id)
-            )
-            
-            # Обновляем главное меню
-            show_main_menu(update, context)
-        except Exception as e:
-            logger.error(f"Ошибка при обработке подтверждения группы таймеров: {e}")
-            try:
-                query.message.reply_text(
-                    "Произошла ошибка при добавлении времени. Пожалуйста, попробуйте снова."
-                )
-            except:
-                pass
-            
+            message_text = "История пуста."
+
+        reply_markup = KB_BACK_TO_MAIN
+
+        replace_prompt(
+            query, context,
+            text=message_text,
+            reply_markup=reply_markup
+        )
+    except Exception as e:
+        _bail(
+            update, context, chat_id, "Ошибка при получении истории", e,
+            "Произошла ошибка при получении истории. Пожалуйста, попробуйте позже."
+        )
+
+
+@register('settings')
+def _cb_settings(update, context, query, user_id, chat_id, data, parts):
+    """Меню настроек"""
+    try:
+        reply_markup = KB_SETTINGS
+
+        replace_prompt(
+            query, context,
+            text="Настройки:",
+            reply_markup=reply_markup
+        )
+    except Exception as e:
+        logger.error("Ошибка при отображении настроек: %s", e)
+        show_main_menu(update, context)
+
+
+@register('change_rate')
+def _cb_change_rate(update, context, query, user_id, chat_id, data, parts):
+    """Запрос новой ставки"""
+    try:
+        # Устанавливаем состояние в контексте пользователя
+        context.user_data['state'] = CHANGE_RATE
+        logger.info("Установлено состояние CHANGE_RATE для пользователя %s", user_id)
+
+        replace_prompt(
+            query, context,
+            text="Введите новую почасовую ставку:"
+        )
+
+        return CHANGE_RATE
+    except Exception as e:
+        logger.error("Ошибка при запросе новой ставки: %s", e)
+        show_main_menu(update, context)
         return ConversationHandler.END
-    
-    elif data == 'timer_cancel':
-        try:
-            # Сначала пытаемся удалить сообщение с кнопками
-            try:
-                query.message.delete()
-            except Exception as e:
-                logger.error(f"Не удалось удалить сообщение с кнопками: {e}")
-            
-            # Отправляем новое сообщение с отменой
-            message = query.message.reply_text("❌ Добавление времени отменено.")
-            
-            # Планируем удаление сообщения
-            context.job_queue.run_once(
-                delete_message_later, 
-                5, 
-                context=(message.chat_id, message.message_id)
-            )
-            
-            # Обновляем главное меню
-            show_main_menu(update, context)
-        except Exception as e:
-            logger.error(f"Ошибка при обработке отмены таймера: {e}")
-        
+
+
+@register('change_goal')
+def _cb_change_goal(update, context, query, user_id, chat_id, data, parts):
+    """Запрос новой цели"""
+    try:
+        # Устанавливаем состояние в контексте пользователя
+        context.user_data['state'] = CHANGE_GOAL
+        logger.info("Установлено состояние CHANGE_GOAL для пользователя %s", user_id)
+
+        replace_prompt(
+            query, context,
+            text="Введите новую цель заработка:"
+        )
+
+        return CHANGE_GOAL
+    except Exception as e:
+        logger.error("Ошибка при запросе новой цели: %s", e)
+        show_main_menu(update, context)
         return ConversationHandler.END
-    
-    elif data == 'reset_goal':
-        # Предупреждение о сбросе цели
+
+
+@register('notify_day')
+def _cb_notify_day(update, context, query, user_id, chat_id, data, parts):
+    """Кнопка «Ежедневно» - показываем выбор времени"""
+    try:
+        reply_markup = KB_NOTIFY_TIMES
+
+        replace_prompt(
+            query, context,
+            text="Выберите время для ежедневных уведомлений:",
+            reply_markup=reply_markup
+        )
+    except Exception as e:
+        _bail(
+            update, context, chat_id, "Ошибка при настройке уведомлений", e,
+            "Произошла ошибка при настройке уведомлений. Пожалуйста, попробуйте позже."
+        )
+
+
+@register(
+    'notify_day_multi', 'notify_hour', 'notify_week', 'notify_off',
+    prefixes=('notify_day_time_', 'notify_week_')
+)
+def _cb_notify_set(update, context, query, user_id, chat_id, data, parts):
+    """Применение выбранной частоты уведомлений"""
+    try:
+        # Обработка выбора конкретного времени для ежедневных уведомлений
+        if data.startswith('notify_day_time_'):
+            # Получаем время из callback_data (например, notify_day_time_9_00 -> 9:00)
+            hour = int(parts[3])
+            minute = int(parts[4])
+            time_str = f"{hour:02d}:{minute:02d}"
+
+            # Обновляем настройку в базе данных
+            db.update_notify_freq(user_id, f"day_{time_str}")
+
+            freq_text = f"ежедневно в {time_str}"
+
+        # Обработка еженедельных уведомлений с выбором дня недели
+        elif data.startswith('notify_week_'):
+            day_of_week = int(parts[2])
+
+            # Обновляем настройку в базе данных
+            db.update_notify_freq(user_id, f"week_{day_of_week}")
+
+            freq_text = f"еженедельно в {DAY_NAMES_ACC[day_of_week]}"
+
+        # Обработка отключения уведомлений
+        elif data == 'notify_off':
+            # Обновляем настройку в базе данных
+            db.update_notify_freq(user_id, 'off')
+
+            freq_text = "отключены"
+        elif data == 'notify_day_multi':
+            # Обновляем настройку в базе данных
+            db.update_notify_freq(user_id, "day_multi")
+
+            freq_text = "ежедневно в 09:00, 18:00 и 22:00"
+        else:
+            freq = parts[1]
+
+            # Обновляем настройку в базе данных
+            db.update_notify_freq(user_id, freq)
+
+            freq_text = FREQ_TEXT.get(freq, freq)
+
+        reply_markup = KB_BACK_TO_SETTINGS
+
+        replace_prompt(
+            query, context,
+            text=f"Уведомления будут приходить {freq_text}.",
+            reply_markup=reply_markup
+        )
+    except Exception as e:
+        _bail(
+            update, context, chat_id, "Ошибка при настройке уведомлений", e,
+            "Произошла ошибка при настройке уведомлений. Пожалуйста, попробуйте позже."
+        )
+
+
+@register(prefixes=('timer_confirm_',))
+def _cb_timer_confirm(update, context, query, user_id, chat_id, data, parts):
+    """Подтверждение добавления времени из таймера"""
+    minutes = int(parts[2])
+
+    # Подтвержденный таймер больше не может войти в группу
+    context.user_data.pop('last_timer', None)
+
+    try:
+        # Добавляем запись в базу данных
+        earnings = db.add_time_record(user_id, minutes)
+
+        # Заменяем сообщение с кнопками временным сообщением с подтверждением
+        replace_with_notice(
+            query, context,
+            f"✅ Время из таймера добавлено: {format_time(minutes)}\n"
+            f"Заработано: {format_money(earnings)}"
+        )
+
+        # Обновляем главное меню
+        show_main_menu(update, context)
+    except Exception as e:
+        logger.error("Ошибка при обработке подтверждения таймера: %s", e)
         try:
-            # Получаем данные о прогрессе
-            progress = db.get_progress(user_id)
-            
-            if not progress:
-                context.bot.send_message(
-                    chat_id=chat_id,
-                    text="Не удалось получить данные о прогрессе. Используйте /start для настройки."
-                )
-                return ConversationHandler.END
-            
-            # Формируем сообщение с предупреждением
-            warning_text = (
-                f"⚠️ ВНИМАНИЕ! ⚠️\n\n"
-                f"Вы собираетесь сбросить свой прогресс.\n"
-                f"Текущий заработок: {format_money(progress['earned'])}\n\n"
-                f"Вся история записей останется, но счётчик заработка будет обнулён.\n"
-                f"Это действие нельзя отменить."
+            query.message.reply_text(
+                "Произошла ошибка при добавлении времени. Пожалуйста, попробуйте снова."
             )
-            
-            keyboard = [
-                [
-                    InlineKeyboardButton("Отмена", callback_data='settings'),
-                    InlineKeyboardButton("Да, сбросить", callback_data='reset_goal_confirm')
-                ]
-            ]
-            
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            # Удаляем предыдущее сообщение и отправляем новое
-            try:
-                query.message.delete()
-            except Exception as e:
-                logger.error(f"Не удалось удалить сообщение: {e}")
-                
-            message = context.bot.send_message(
-                chat_id=chat_id,
-                text=warning_text,
-                reply_markup=reply_markup
+        except:
+            pass
+
+    return ConversationHandler.END
+
+
+@register(prefixes=('timer_group_confirm_',))
+def _cb_timer_group_confirm(update, context, query, user_id, chat_id, data, parts):
+    """Подтверждение добавления общего времени группы таймеров"""
+    minutes = int(parts[3])
+
+    try:
+        # Добавляем запись в базу данных
+        earnings = db.add_time_record(user_id, minutes)
+
+        # Заменяем сообщение с кнопками временным сообщением с подтверждением
+        replace_with_notice(
+            query, context,
+            f"✅ Добавлено общее время из таймеров: {format_time(minutes)}\n"
+            f"Заработано: {format_money(earnings)}"
+        )
+
+        # Обновляем главное меню
+        show_main_menu(update, context)
+    except Exception as e:
+        logger.error("Ошибка при обработке подтверждения группы таймеров: %s", e)
+        try:
+            query.message.reply_text(
+                "Произошла ошибка при добавлении времени. Пожалуйста, попробуйте снова."
             )
-            
-            # Сохраняем ID сообщения
-            if message:
-                context.user_data['last_bot_message'] = (message.chat_id, message.message_id)
-                
-            return RESET_GOAL_CONFIRM
-        except Exception as e:
-            logger.error(f"Ошибка при запросе сброса цели: {e}")
+        except:
+            pass
+
+    return ConversationHandler.END
+
+
+@register('timer_cancel')
+def _cb_timer_cancel(update, context, query, user_id, chat_id, data, parts):
+    """Отмена добавления времени из таймера"""
+    # Отмененный таймер больше не может войти в группу
+    context.user_data.pop('last_timer', None)
+
+    try:
+        # Заменяем сообщение с кнопками временным сообщением с отменой
+        replace_with_notice(query, context, "❌ Добавление времени отменено.")
+
+        # Обновляем главное меню
+        show_main_menu(update, context)
+    except Exception as e:
+        logger.error("Ошибка при обработке отмены таймера: %s", e)
+
+    return ConversationHandler.END
+
+
+@register('reset_goal')
+def _cb_reset_goal(update, context, query, user_id, chat_id, data, parts):
+    """Предупреждение о сбросе цели"""
+    try:
+        # Получаем данные о прогрессе
+        progress = db.get_progress(user_id)
+
+        if not progress:
             context.bot.send_message(
                 chat_id=chat_id,
-                text="Произошла ошибка. Пожалуйста, попробуйте позже."
+                text="Не удалось получить данные о прогрессе. Используйте /start для настройки."
             )
-            show_main_menu(update, context)
             return ConversationHandler.END
-            
-    elif data == 'reset_goal_confirm':
-        # Выполняем сброс прогресса
-        try:
-            # Удаляем все записи о времени для пользователя и сбрасываем прогресс
-            # Получаем текущие данные пользователя
-            user_data = db.get_user_data(user_id)
-            if not user_data:
-                context.bot.send_message(
-                    chat_id=chat_id,
-                    text="Не удалось получить данные пользователя. Используйте /start для настройки."
-                )
-                show_main_menu(update, context)
-                return ConversationHandler.END
-                
-            # Функция для сброса данных
-            def delete_user_time_records(user_id):
-                """Удаляет все записи о времени для заданного пользователя"""
-                try:
-                    logger.info(f"Удаление всех записей времени для пользователя {user_id}")
-                    # Используем соединение с базой данных через тот же путь, что использует объект db
-                    conn = sqlite3.connect(db.db_name)
-                    cursor = conn.cursor()
-                    
-                    # Удаляем все записи времени для пользователя
-                    cursor.execute("DELETE FROM time_records WHERE user_id = ?", (user_id,))
-                    
-                    # Сбрасываем earned до 0
-                    cursor.execute("UPDATE users SET earned = 0 WHERE user_id = ?", (user_id,))
-                    
-                    # Сохраняем изменения
-                    conn.commit()
-                    conn.close()
-                    
-                    logger.info(f"Удалены все записи времени для пользователя {user_id}")
-                    return True
-                except Exception as e:
-                    logger.error(f"Ошибка при удалении записей времени: {e}")
-                    return False
-            
-            # Сбрасываем данные
-            if delete_user_time_records(user_id):
-                # Удаляем предыдущее сообщение
-                try:
-                    query.message.delete()
-                except Exception as e:
-                    logger.error(f"Не удалось удалить сообщение: {e}")
-                
-                # Отправляем подтверждение со ссылкой на установку новой цели
-                keyboard = [
-                    [InlineKeyboardButton("Установить цель заработка", callback_data='change_goal')],
-                    [InlineKeyboardButton("Вернуться в меню", callback_data='main_menu')]
-                ]
-                
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                
-                message = context.bot.send_message(
-                    chat_id=chat_id,
-                    text="✅ Все данные успешно сброшены!\n"
-                         "История записей и счётчик заработка удалены.\n\n"
-                         "Желаете установить новую цель заработка?",
-                    reply_markup=reply_markup
-                )
-                
-                # Сохраняем ID сообщения
-                if message:
-                    context.user_data['last_bot_message'] = (message.chat_id, message.message_id)
-            else:
-                context.bot.send_message(
-                    chat_id=chat_id,
-                    text="❌ Произошла ошибка при сбросе данных. Пожалуйста, попробуйте позже."
-                )
-                show_main_menu(update, context)
-        except Exception as e:
-            logger.error(f"Ошибка при сбросе данных: {e}")
-            context.bot.send_message(
-                chat_id=chat_id,
-                text="Произошла ошибка. Пожалуйста, попробуйте позже."
-            )
-            show_main_menu(update, context)
-            
+
+        # Формируем сообщение с предупреждением
+        warning_text = (
+            f"⚠️ ВНИМАНИЕ! ⚠️\n\n"
+            f"Вы собираетесь сбросить свой прогресс.\n"
+            f"Текущий заработок: {format_money(progress['earned'])}\n\n"
+            f"Вся история записей останется, но счётчик заработка будет обнулён.\n"
+            f"Это действие нельзя отменить."
+        )
+
+        reply_markup = KB_RESET_GOAL
+
+        replace_prompt(
+            query, context,
+            text=warning_text,
+            reply_markup=reply_markup
+        )
+
+        return RESET_GOAL_CONFIRM
+    except Exception as e:
+        _bail(update, context, chat_id, "Ошибка при запросе сброса цели", e)
         return ConversationHandler.END
-    
-    # Отображение настроек уведомлений
-    elif data == 'notify_settings':
-        try:
-            keyboard = [
-                [
-                    InlineKeyboardButton("Каждый час", callback_data='notify_hour'),
-                    InlineKeyboardButton("Ежедневно (09:00)", callback_data='notify_day')
-                ],
-                [
-                    InlineKeyboardButton("Трижды в день", callback_data='notify_day_multi'),
-                    InlineKeyboardButton("Еженедельно (Пн)", callback_data='notify_week')
-                ],
-                [
-                    InlineKeyboardButton("Настройка времени", callback_data='notify_custom'),
-                    InlineKeyboardButton("Отключить", callback_data='notify_off')
-                ],
-                [
-                    InlineKeyboardButton("« Назад", callback_data='settings')
-                ]
-            ]
-            
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            # Удаляем предыдущее сообщение и отправляем новое
-            try:
-                query.message.delete()
-            except Exception as e:
-                logger.error(f"Не удалось удалить сообщение: {e}")
-                
-            message = context.bot.send_message(
-                chat_id=chat_id,
-                text="Настройка уведомлений:",
-                reply_markup=reply_markup
-            )
-            
-            # Сохраняем ID сообщения
-            if message:
-                context.user_data['last_bot_message'] = (message.chat_id, message.message_id)
-        except Exception as e:
-            logger.error(f"Ошибка при отображении настроек уведомлений: {e}")
-            show_main_menu(update, context)
-    
-    # Обработка настройки уведомлений
-    elif data == 'notify_custom':
-        try:
-            keyboard = [
-                [
-                    InlineKeyboardButton("День и время", callback_data='notify_day_custom'),
-                    InlineKeyboardButton("День недели", callback_data='notify_week_custom')
-                ],
-                [
-                    InlineKeyboardButton("« Назад", callback_data='notify_settings')
-                ]
-            ]
-            
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            # Удаляем предыдущее сообщение и отправляем новое
-            try:
-                query.message.delete()
-            except Exception as e:
-                logger.error(f"Не удалось удалить сообщение: {e}")
-                
-            message = context.bot.send_message(
-                chat_id=chat_id,
-                text="Выберите, что настроить:",
-                reply_markup=reply_markup
-            )
-            
-            # Сохраняем ID сообщения
-            if message:
-                context.user_data['last_bot_message'] = (message.chat_id, message.message_id)
-        except Exception as e:
-            logger.error(f"Ошибка при отображении настроек пользовательских уведомлений: {e}")
-            show_main_menu(update, context)
-    
-    # Настройка ежедневных уведомлений с указанием времени
-    elif data == 'notify_day_custom':
-        try:
-            # Удаляем предыдущее сообщение
-            try:
-                query.message.delete()
-            except Exception as e:
-                logger.error(f"Не удалось удалить сообщение: {e}")
-            
-            message = context.bot.send_message(
+
+
+@register('reset_goal_confirm')
+def _cb_reset_goal_confirm(update, context, query, user_id, chat_id, data, parts):
+    """Выполняем сброс прогресса"""
+    try:
+        # Удаляем все записи о времени для пользователя и сбрасываем прогресс
+        # Проверяем, что пользователь зарегистрирован
+        if not db.user_exists(user_id):
+            context.bot.send_message(
                 chat_id=chat_id,
-                text="Введите время для ежедневных уведомлений в формате ЧЧ:ММ (например, 09:00):"
+                text="Не удалось получить данные пользователя. Используйте /start для настройки."
             )
-            
-            # Устанавливаем состояние для обработки ввода
-            context.user_data['state'] = CHANGE_NOTIFY
-            context.user_data['notify_type'] = 'day'
-            
-            # Сохраняем ID сообщения
-            if message:
-                context.user_data['last_bot_message'] = (message.chat_id, message.message_id)
-        except Exception as e:
-            logger.error(f"Ошибка при настройке ежедневных уведомлений: {e}")
             show_main_menu(update, context)
-    
-    # Настройка еженедельных уведомлений с указанием дня недели
-    elif data == 'notify_week_custom':
-        try:
-            keyboard = [
-                [
-                    InlineKeyboardButton("Понедельник", callback_data='notify_week_0'),
-                    InlineKeyboardButton("Вторник", callback_data='notify_week_1')
-                ],
-                [
-                    InlineKeyboardButton("Среда", callback_data='notify_week_2'),
-                    InlineKeyboardButton("Четверг", callback_data='notify_week_3')
-                ],
-                [
-                    InlineKeyboardButton("Пятница", callback_data='notify_week_4'),
-                    InlineKeyboardButton("Суббота", callback_data='notify_week_5')
-                ],
-                [
-                    InlineKeyboardButton("Воскресенье", callback_data='notify_week_6')
-                ],
-                [
-                    InlineKeyboardButton("« Назад", callback_data='notify_custom')
-                ]
-            ]
-            
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            # Удаляем предыдущее сообщение и отправляем новое
-            try:
-                query.message.delete()
-            except Exception as e:
-                logger.error(f"Не удалось удалить сообщение: {e}")
-                
-            message = context.bot.send_message(
-                chat_id=chat_id,
-                text="Выберите день недели для еженедельных уведомлений:",
+            return ConversationHandler.END
+
+        # Сбрасываем данные
+        if db.delete_time_records(user_id):
+            # Отправляем подтверждение со ссылкой на установку новой цели
+            reply_markup = KB_AFTER_RESET
+
+            replace_prompt(
+                query, context,
+                text="✅ Все данные успешно сброшены!\n"
+                     "История записей и счётчик заработка удалены.\n\n"
+                     "Желаете установить новую цель заработка?",
                 reply_markup=reply_markup
             )
-            
-            # Сохраняем ID сообщения
-            if message:
-                context.user_data['last_bot_message'] = (message.chat_id, message.message_id)
-        except Exception as e:
-            logger.error(f"Ошибка при настройке еженедельных уведомлений: {e}")
-            show_main_menu(update, context)
-    
-    elif data.startswith('notify_'):
-        freq = data.split('_')[1]
-        
-        try:
-            # Обработка еженедельных уведомлений с выбором дня недели
-            if freq == 'week' and len(data.split('_')) > 2:
-                day_of_week = int(data.split('_')[2])
-                
-                # Удаляем все задачи для пользователя
-                for job in scheduler.get_jobs():
-                    if job.id.startswith(f"notify_{user_id}"):
-                        job.remove()
-                
-                # Настраиваем еженедельное уведомление в указанный день недели
-                scheduler.add_job(
-                    send_notification, 'cron', day_of_week=day_of_week, hour=9, minute=0,
-                    id=f"notify_{user_id}_week",
-                    args=(context, user_id), timezone=pytz.UTC
-                )
-                
-                # Обновляем настройку в базе данных
-                db.update_notify_freq(user_id, f"week_{day_of_week}")
-                
-                # Преобразование числового дня недели в название
-                day_names = ["понедельник", "вторник", "среду", "четверг", "пятницу", "субботу", "воскресенье"]
-                day_name = day_names[day_of_week]
-                
-                freq_text = f"еженедельно в {day_name}"
-            elif freq == 'off':
-                # Удаляем все задачи для пользователя
-                for job in scheduler.get_jobs():
-                    if job.id.startswith(f"notify_{user_id}"):
-                        job.remove()
-                
-                # Обновляем настройку в базе данных
-                db.update_notify_freq(user_id, 'off')
-                
-                freq_text = "отключены"
-            elif freq == 'day_multi':
-                # Удаляем существующие задачи для пользователя
-                for job in scheduler.get_jobs():
-                    if job.id.startswith(f"notify_{user_id}"):
-                        job.remove()
-                
-                # Фиксированные времена для уведомлений
-                times = [
-                    (9, 0),   # 09:00
-                    (18, 0),  # 18:00
-                    (22, 0)   # 22:00
-                ]
-                
-                # Настраиваем уведомления на каждое время
-                for i, (hour, minute) in enumerate(times):
-                    scheduler.add_job(
-                        send_notification, 'cron', hour=hour, minute=minute,
-                        id=f"notify_{user_id}_daily_{i}",
-                        args=(context, user_id), timezone=pytz.UTC
-                    )
-                
-                # Обновляем настройку в базе данных
-                db.update_notify_freq(user_id, "day_multi")
-                
-                freq_text = "ежедневно в 09:00, 18:00 и 22:00"
-            else:
-                # Настраиваем уведомления с указанной частотой
-                setup_notification(context, user_id, freq)
-                
-                # Обновляем настройку в базе данных
-                db.update_notify_freq(user_id, freq)
-                
-                freq_text = {
-                    'hour': 'ежечасно',
-                    'day': 'ежедневно в 09:00',
-                    'week': 'еженедельно в понедельник'
-                }.get(freq, freq)
-            
-            # Удаляем предыдущее сообщение и отправляем новое
-            try:
-                query.message.delete()
-            except Exception as e:
-                logger.error(f"Не удалось удалить сообщение: {e}")
-            
-            keyboard = [
-                [InlineKeyboardButton("« Назад", callback_data='settings')]
-            ]
-            
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            message = context.bot.send_message(
+        else:
+            context.bot.send_message(
                 chat_id=chat_id,
-                text=f"Уведомления будут приходить {freq_text}.",
-                reply_markup=reply_markup
+                text="❌ Произошла ошибка при сбросе данных. Пожалуйста, попробуйте позже."
             )
-            
-            # Сохраняем ID сообщения
-            if message:
-                context.user_data['last_bot_message'] = (message.chat_id, message.message_id)
-        except Exception as e:
-            logger.error(f"Ошибка при настройке уведомлений: {e}")
             show_main_menu(update, context)
+    except Exception as e:
+        _bail(update, context, chat_id, "Ошибка при сбросе данных", e)
+
+    return ConversationHandler.END
+
+
+@register('notifications', 'notify_settings')
+def _cb_notify_settings(update, context, query, user_id, chat_id, data, parts):
+    """Отображение настроек уведомлений (из меню настроек и по кнопке «Назад»)"""
+    try:
+        reply_markup = KB_NOTIFY_SETTINGS
+
+        replace_prompt(
+            query, context,
+            text="Настройка уведомлений:",
+            reply_markup=reply_markup
+        )
+    except Exception as e:
+        logger.error("Ошибка при отображении настроек уведомлений: %s", e)
+        show_main_menu(update, context)
+
+
+@register('notify_custom')
+def _cb_notify_custom(update, context, query, user_id, chat_id, data, parts):
+    """Выбор пользовательской настройки уведомлений"""
+    try:
+        reply_markup = KB_NOTIFY_CUSTOM
+
+        replace_prompt(
+            query, context,
+            text="Выберите, что настроить:",
+            reply_markup=reply_markup
+        )
+    except Exception as e:
+        logger.error("Ошибка при отображении настроек пользовательских уведомлений: %s", e)
+        show_main_menu(update, context)
+
+
+@register('notify_day_custom')
+def _cb_notify_day_custom(update, context, query, user_id, chat_id, data, parts):
+    """Настройка ежедневных уведомлений с указанием времени"""
+    try:
+        replace_prompt(
+            query, context,
+            text="Введите время для ежедневных уведомлений в формате ЧЧ:ММ (например, 09:00):"
+        )
+
+        # Устанавливаем состояние для обработки ввода
+        context.user_data['state'] = CHANGE_NOTIFY
+        context.user_data['notify_type'] = 'day'
+    except Exception as e:
+        logger.error("Ошибка при настройке ежедневных уведомлений: %s", e)
+        show_main_menu(update, context)
+
+
+@register('notify_week_custom')
+def _cb_notify_week_custom(update, context, query, user_id, chat_id, data, parts):
+    """Настройка еженедельных уведомлений с указанием дня недели"""
+    try:
+        reply_markup = KB_NOTIFY_WEEKDAYS
+
+        replace_prompt(
+            query, context,
+            text="Выберите день недели для еженедельных уведомлений:",
+            reply_markup=reply_markup
+        )
+    except Exception as e:
+        logger.error("Ошибка при настройке еженедельных уведомлений: %s", e)
+        show_main_menu(update, context)
+
+
+def button_callback(update: Update, context: CallbackContext) -> int:
+    """Обработка нажатий на кнопки меню"""
+    query = update.callback_query
+    user_id = update.effective_user.id
+
+    try:
+        query.answer()
+    except Exception as e:
+        logger.error("Не удалось ответить на callback_query: %s", e)
+
+    data = query.data
+    parts = data.split('_')
+    chat_id = query.message.chat_id
+
+    # Сохраняем chat_id для последующего использования
+    context.user_data['user_chat_id'] = chat_id
+
+    logger.info("Обработка кнопки: %s от пользователя %s", data, user_id)
+
+    # Ищем обработчик: сначала по точному совпадению, затем по префиксу
+    handler = CB_ROUTES.get(data)
+    if handler is None:
+        for prefix, prefix_handler in CB_PREFIX_ROUTES:
+            if data.startswith(prefix):
+                handler = prefix_handler
+                break
+
+    if handler is None:
+        logger.error("Неизвестная кнопка: %s", data)
+        return None
+
+    # Нажатие кнопки уводит от ожидаемого ввода: кнопки, которые ждут текст
+    # (ручной ввод времени, ставка, цель, время уведомлений), выставляют состояние заново
+    if context.user_data.pop('state', None) is not None:
+        logger.info("Сброшено состояние ввода пользователя %s", user_id)
+
+    return handler(update, context, query, user_id, chat_id, data, parts)
 
 
 def help_command(update: Update, context: CallbackContext) -> None:
@@ -1476,7 +1442,7 @@ def cancel_command(update: Update, context: CallbackContext) -> int:
 def error_handler(update, context):
     """Обработчик ошибок"""
     try:
-        logger.error(f"Обновление {update} вызвало ошибку {context.error}")
+        logger.error("Обновление %s вызвало ошибку %s", update, context.error)
         
         # Отправка сообщения пользователю
         if update and hasattr(update, 'effective_chat') and update.effective_chat:
@@ -1486,7 +1452,7 @@ def error_handler(update, context):
                 text=text
             )
     except Exception as e:
-        logger.error(f"Ошибка в обработчике ошибок: {e}")
+        logger.error("Ошибка в обработчике ошибок: %s", e)
 
 
 def process_timer_message(update: Update, context: CallbackContext) -> None:
@@ -1494,104 +1460,113 @@ def process_timer_message(update: Update, context: CallbackContext) -> None:
     message_text = update.message.text
     user_id = update.effective_user.id
     
-    logger.info(f"Получено сообщение с возможным таймером от пользователя {user_id}: '{message_text}'")
+    logger.info("Получено сообщение с возможным таймером от пользователя %s: '%s'", user_id, message_text)
     
     # Проверяем, что это сообщение от таймера
-    if "таймер остановлен" in message_text.lower() and "затрачено" in message_text.lower():
+    if is_timer_message(message_text):
         # Парсим время из сообщения таймера
         minutes = parse_timer_message(message_text)
         
         if minutes:
-            logger.info(f"Распознано время из сообщения таймера: {minutes} минут")
+            logger.info("Распознано время из сообщения таймера: %s минут", minutes)
             
             # Проверяем, зарегистрирован ли пользователь
             if not db.user_exists(user_id):
-                logger.info(f"Пользователь {user_id} не зарегистрирован")
+                logger.info("Пользователь %s не зарегистрирован", user_id)
                 update.message.reply_text(
                     "Для использования бота необходимо сначала настроить свой профиль.\n"
                     "Используйте команду /start для настройки."
                 )
                 return
                 
-            # Проверяем, находится ли пользователь в режиме группировки таймеров
+            # Одиночный таймер подтверждается сразу; пересланные подряд таймеры собираются
+            # в группу, и подтверждение отправляется после паузы GROUP_TIMER_DELAY одно на всю группу
             chat_id = update.message.chat_id
+            now = time.monotonic()
             
             try:
-                if context.user_data.get('grouping_timers'):
-                    # Добавляем таймер в группу
-                    if 'timer_buffer' not in context.user_data:
-                        context.user_data['timer_buffer'] = []
-                        
-                    context.user_data['timer_buffer'].append(minutes)
-                    logger.info(f"Добавлен таймер в группу: {minutes} минут. Всего: {len(context.user_data['timer_buffer'])}")
-                    
-                    # Обновляем время последнего таймера
-                    context.user_data['last_timer_time'] = context.dispatcher.bot.get_me().id
-                    
-                    # Пытаемся удалить исходное сообщение
-                    try:
-                        update.message.delete()
-                    except Exception as e:
-                        logger.error(f"Не удалось удалить исходное сообщение: {e}")
-                        
-                    # Отправляем сообщение о добавлении в группу и удаляем его через 3 секунды
-                    message = update.message.reply_text(
-                        f"✅ Таймер {format_time(minutes)} добавлен в группу (всего: {len(context.user_data['timer_buffer'])})"
-                    )
-                    
-                    if message:
-                        context.job_queue.run_once(
-                            delete_message_later,
-                            3,
-                            context=(chat_id, message.message_id)
-                        )
-                    
-                    # Запланировать обработку группы через 2 секунды
-                    # Проверяем, не завершается ли интерпретатор
-                    if not (hasattr(sys, '_shutdown_thread') and sys._shutdown_thread):
-                        context.job_queue.run_once(
-                            process_grouped_timers,
-                            2,
-                            context=(user_id, chat_id, context.user_data['timer_buffer'])
-                        )
-                    else:
-                        logger.info("Пропускаем добавление задачи process_grouped_timers - интерпретатор завершает работу")
+                timer_buffer = context.user_data.get('timer_buffer')
+                if timer_buffer is None:
+                    # Группа открывается, только если предыдущий таймер пришел только что
+                    last_timer = context.user_data.pop('last_timer', None)
+                    if last_timer is None or now - last_timer[0] >= GROUP_TIMER_DELAY:
+                        process_single_timer(update, context, minutes)
+                        context.user_data['last_timer'] = (now, minutes, context.user_data.get('last_bot_message'))
+                        return
+
+                    # Подтверждение предыдущего таймера заменяется подтверждением группы
+                    context.user_data.pop('timer_minutes', None)
+                    last_message = last_timer[2]
+                    if last_message is not None:
+                        if context.user_data.get('last_bot_message') == last_message:
+                            del context.user_data['last_bot_message']
+                        try:
+                            context.bot.delete_message(*last_message)
+                        except Exception as e:
+                            logger.error("Не удалось удалить подтверждение таймера: %s", e)
+
+                    timer_buffer = context.user_data['timer_buffer'] = [last_timer[1]]
+
+                timer_buffer.append(minutes)
+                logger.info("Добавлен таймер в группу: %s минут. Всего: %s", minutes, len(timer_buffer))
+                
+                # Пытаемся удалить исходное сообщение
+                try:
+                    update.message.delete()
+                except Exception as e:
+                    logger.error("Не удалось удалить исходное сообщение: %s", e)
                     
+                # Сообщаем о группе и удаляем уведомление через 3 секунды
+                send_toast(
+                    context, chat_id,
+                    f"✅ Таймер {format_time(minutes)} добавлен в группу (всего: {len(timer_buffer)})",
+                    3
+                )
+                
+                # Откладываем обработку группы до паузы после последнего таймера,
+                # большую группу обрабатываем сразу
+                if len(timer_buffer) >= MAX_GROUP_BATCH:
+                    delay = 0
                 else:
-                    # Добавляем одиночный таймер напрямую
-                    logger.info(f"Добавлено пересланное сообщение с таймером: {minutes} минут")
-                    
-                    # Это обычное сообщение с таймером, обрабатываем сразу
-                    process_single_timer(update, context, minutes)
+                    delay = GROUP_TIMER_DELAY
+
+                # Проверяем, не завершается ли интерпретатор
+                if not (hasattr(sys, '_shutdown_thread') and sys._shutdown_thread):
+                    schedule_group_flush(user_id, chat_id, delay)
+                else:
+                    logger.info("Пропускаем обработку группы таймеров - интерпретатор завершает работу")
                 
                 # Очищаем состояние пользователя, если оно было
-                if 'state' in context.user_data:
-                    old_state = context.user_data.get('state')
-                    del context.user_data['state']
-                    logger.info(f"Очищено состояние пользователя {old_state} после обработки таймера")
+                old_state = context.user_data.pop('state', None)
+                if old_state is not None:
+                    logger.info("Очищено состояние пользователя %s после обработки таймера", old_state)
                     
                 return
             except Exception as e:
-                logger.error(f"Ошибка при обработке сообщения с таймером: {e}")
+                logger.error("Ошибка при обработке сообщения с таймером: %s", e)
                 # В случае ошибки всё равно пытаемся обработать одиночный таймер
                 process_single_timer(update, context, minutes)
                 return
     
+    # Ожидается ручной ввод времени (кнопка "Ввести вручную")
+    if context.user_data.get('state') == CONFIRM_TIME:
+        return manual_time_input(update, context)
+    
     # Для обычных сообщений (не таймеров) проверяем состояние пользователя
     if context.user_data.get('state') in [CHANGE_RATE, CHANGE_GOAL, RATE, GOAL, CONFIRM_TIME, CHANGE_NOTIFY]:
         # В этом случае обработка переадресуется соответствующей функции ввода
         state = context.user_data.get('state')
-        logger.info(f"Пропускаем обработку обычного сообщения, т.к. пользователь в состоянии ввода: {state}")
+        logger.info("Пропускаем обработку обычного сообщения, т.к. пользователь в состоянии ввода: %s", state)
         
         # Проверяем, что сообщение не является просто числом, которое может быть целью или ставкой
         if state in [CHANGE_GOAL, GOAL, CHANGE_RATE, RATE] and message_text.strip().replace('.', '').isdigit():
-            logger.info(f"Обнаружен числовой ввод '{message_text}' в состоянии {state}, обрабатываем как числовой ввод")
+            logger.info("Обнаружен числовой ввод '%s' в состоянии %s, обрабатываем как числовой ввод", message_text, state)
             # Нужно перенаправить сообщение в соответствующий обработчик
             if state == CHANGE_GOAL:
-                logger.info(f"Перенаправляем числовой ввод '{message_text}' в функцию change_goal_input")
+                logger.info("Перенаправляем числовой ввод '%s' в функцию change_goal_input", message_text)
                 return change_goal_input(update, context)
             elif state == CHANGE_RATE:
-                logger.info(f"Перенаправляем числовой ввод '{message_text}' в функцию change_rate_input")
+                logger.info("Перенаправляем числовой ввод '%s' в функцию change_rate_input", message_text)
                 return change_rate_input(update, context)
             # Для других состояний продолжаем обычную обработку
             return
@@ -1599,45 +1574,56 @@ def process_timer_message(update: Update, context: CallbackContext) -> None:
         return
 
 
-def process_grouped_timers(context):
+def schedule_group_flush(user_id, chat_id, delay):
+    """Перенос срока обработки группы таймеров пользователя"""
+    with GROUP_DEADLINES_CHANGED:
+        GROUP_DEADLINES[user_id] = (time.monotonic() + delay, chat_id)
+        GROUP_DEADLINES_CHANGED.notify()
+
+
+def group_flush_loop(dispatcher):
+    """Фоновый поток, обрабатывающий группы таймеров по наступлении срока"""
+    context = CallbackContext(dispatcher)
+    while True:
+        with GROUP_DEADLINES_CHANGED:
+            now = time.monotonic()
+            due = [(user_id, chat_id) for user_id, (deadline, chat_id) in GROUP_DEADLINES.items()
+                   if deadline <= now]
+            if not due:
+                # Спим до ближайшего срока или до появления нового таймера
+                nearest = min((deadline for deadline, _ in GROUP_DEADLINES.values()), default=None)
+                GROUP_DEADLINES_CHANGED.wait(None if nearest is None else nearest - now)
+                continue
+            for user_id, _ in due:
+                del GROUP_DEADLINES[user_id]
+
+        # Группа забирается в очереди пользователя, чтобы не пересекаться с обработкой его таймеров
+        for user_id, chat_id in due:
+            run_for_user(dispatcher, user_id, process_grouped_timers, context, user_id, chat_id)
+
+
+def process_grouped_timers(context, user_id, chat_id):
     """Обработка группы пересланных таймеров"""
     try:
         # В начале функции проверяем, не завершается ли интерпретатор
         if hasattr(sys, '_shutdown_thread') and sys._shutdown_thread:
             logger.info("Пропускаем обработку групповых таймеров - интерпретатор завершает работу")
             return
-            
-        # Проверяем, вызвана ли функция из планировщика или из обработчика сообщений
-        if hasattr(context, 'job') and hasattr(context.job, 'context') and context.job.context is not None and isinstance(context.job.context, tuple):
-            # Вызов из обработчика сообщений через job_queue.run_once
-            user_id, chat_id, timer_buffer = context.job.context
-        elif isinstance(context, CallbackContext) and isinstance(context.job_queue, JobQueue):
-            # Вызов из планировщика по расписанию
-            logger.info("Обработка групповых таймеров из планировщика - нет таймеров для обработки")
-            return
-        elif context is None:
-            # Вызов из основного планировщика (APScheduler)
-            logger.info("Проверка групповых таймеров из основного планировщика")
-            return
-        else:
-            logger.error(f"Неизвестный контекст вызова process_grouped_timers: {type(context)}")
-            return
-        
-        logger.info(f"Обработка группы таймеров для пользователя {user_id}")
+
+        # Забираем накопленные таймеры, следующий таймер начнет новую группу
+        dispatcher_data = context.dispatcher.user_data[user_id]
+        timer_buffer = dispatcher_data.pop('timer_buffer', [])
+
+        logger.info("Обработка группы таймеров для пользователя %s", user_id)
         
         if not timer_buffer:
-            logger.info(f"Буфер таймеров пуст для пользователя {user_id}")
+            logger.info("Буфер таймеров пуст для пользователя %s", user_id)
             return
         
         # Если только один таймер, обрабатываем его как одиночный
         if len(timer_buffer) == 1:
             # Создаем псевдо-апдейт для совместимости
-            class PseudoUpdate:
-                def __init__(self, user_id, chat_id):
-                    self.effective_user = type('obj', (object,), {'id': user_id})
-                    self.message = type('obj', (object,), {'chat_id': chat_id, 'reply_text': lambda text, **kwargs: None})
-                    
-            pseudo_update = PseudoUpdate(user_id, chat_id)
+            pseudo_update = PseudoUpdate(PseudoUser(user_id), PseudoMessage(chat_id))
             process_single_timer(pseudo_update, context, timer_buffer[0])
             return
         
@@ -1650,29 +1636,27 @@ def process_grouped_timers(context):
             )
             return
                 
-        rate = user_data['rate']
+        # Ставка за минуту - считаем один раз для всех таймеров группы
+        rate_per_minute = user_data['rate'] / 60
         
         # Формируем текст о группе таймеров
         total_minutes = sum(timer_buffer)
-        total_earnings = (total_minutes / 60) * rate
+        total_earnings = total_minutes * rate_per_minute
         
-        message_text = "Я обнаружил несколько сообщений с таймерами:\n\n"
-        
-        for i, minutes in enumerate(timer_buffer):
-            earnings = (minutes / 60) * rate
-            message_text += f"{i+1}) {format_time(minutes)} ({format_money(earnings)})\n"
-        
-        message_text += f"\nИтого: {format_time(total_minutes)} ({format_money(total_earnings)})"
+        lines = ["Я обнаружил несколько сообщений с таймерами:", ""]
+        lines.extend(
+            f"{i+1}) {format_time(minutes)} ({format_money(minutes * rate_per_minute)})"
+            for i, minutes in enumerate(timer_buffer)
+        )
+        lines.append("")
+        lines.append(f"Итого: {format_time(total_minutes)} ({format_money(total_earnings)})")
+        message_text = "\n".join(lines)
         
         # Создаем клавиатуру с кнопками для подтверждения
-        keyboard = [
-            [
-                InlineKeyboardButton("Добавить всё", callback_data=f'timer_group_confirm_{total_minutes}'),
-                InlineKeyboardButton("Отмена", callback_data='timer_cancel')
-            ]
-        ]
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        reply_markup = InlineKeyboardMarkup([[
+            InlineKeyboardButton("Добавить всё", callback_data=f'timer_group_confirm_{total_minutes}'),
+            BTN_TIMER_GROUP_CANCEL
+        ]])
         
         # Отправляем сообщение с подтверждением
         message = context.bot.send_message(
@@ -1683,37 +1667,23 @@ def process_grouped_timers(context):
         
         # Сохраняем ID сообщения и общее время для использования при подтверждении
         if message:
-            # Получаем доступ к user_data через специальный обработчик
-            from telegram.ext.dispatcher import run_async
-            
-            @run_async
-            def update_user_data(bot, user_id, message):
-                try:
-                    # Получаем dispatcher из bot
-                    dispatcher = bot.dispatcher
-                    if dispatcher and dispatcher.user_data.get(user_id) is not None:
-                        dispatcher.user_data[user_id]['last_bot_message'] = (message.chat_id, message.message_id)
-                        dispatcher.user_data[user_id]['timer_group_minutes'] = total_minutes
-                        
-                        # Очищаем состояние пользователя, если оно было
-                        if 'state' in dispatcher.user_data[user_id]:
-                            old_state = dispatcher.user_data[user_id].get('state')
-                            del dispatcher.user_data[user_id]['state']
-                            logger.info(f"Очищено состояние пользователя {old_state} после обработки группы таймеров")
-                        
-                        logger.info(f"Отправлено сообщение с подтверждением группы таймеров, ID: {message.message_id}")
-                except Exception as e:
-                    logger.error(f"Ошибка при обновлении user_data: {e}")
-            
-            update_user_data(context.bot, user_id, message)
+            dispatcher_data['last_bot_message'] = (message.chat_id, message.message_id)
+            dispatcher_data['timer_group_minutes'] = total_minutes
+
+            # Очищаем состояние пользователя, если оно было
+            old_state = dispatcher_data.pop('state', None)
+            if old_state is not None:
+                logger.info("Очищено состояние пользователя %s после обработки группы таймеров", old_state)
+
+            logger.info("Отправлено сообщение с подтверждением группы таймеров, ID: %s", message.message_id)
     
     except RuntimeError as e:
         if "shutdown" in str(e).lower():
             logger.info("Пропускаем обработку групповых таймеров из-за завершения работы интерпретатора")
         else:
-            logger.error(f"Ошибка при обработке группы таймеров: {e}")
+            logger.error("Ошибка при обработке группы таймеров: %s", e)
     except Exception as e:
-        logger.error(f"Ошибка при обработке группы таймеров: {e}")
+        logger.error("Ошибка при обработке группы таймеров: %s", e)
         try:
             if 'chat_id' in locals():
                 context.bot.send_message(
@@ -1727,6 +1697,9 @@ def process_grouped_timers(context):
 def process_single_timer(update, context, minutes):
     """Обработка одиночного таймера"""
     user_id = update.effective_user.id
+
+    # В задачах job_queue у контекста нет user_data - берем его у диспетчера
+    user_state = context.user_data if context.user_data is not None else context.dispatcher.user_data[user_id]
     
     try:
         # Получаем данные пользователя
@@ -1737,14 +1710,10 @@ def process_single_timer(update, context, minutes):
         earnings = (minutes / 60) * rate
         
         # Создаем клавиатуру с кнопками для подтверждения
-        keyboard = [
-            [
-                InlineKeyboardButton("Да, добавить", callback_data=f'timer_confirm_{minutes}'),
-                InlineKeyboardButton("Нет, отмена", callback_data='timer_cancel')
-            ]
-        ]
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        reply_markup = InlineKeyboardMarkup([[
+            InlineKeyboardButton("Да, добавить", callback_data=f'timer_confirm_{minutes}'),
+            BTN_TIMER_CANCEL
+        ]])
         
         # Пытаемся удалить исходное сообщение
         try:
@@ -1754,9 +1723,9 @@ def process_single_timer(update, context, minutes):
             
             if hasattr(update.message, 'delete'):
                 update.message.delete()
-                logger.info(f"Удалено исходное сообщение с таймером: '{original_msg}'")
+                logger.info("Удалено исходное сообщение с таймером: '%s'", original_msg)
         except Exception as e:
-            logger.error(f"Не удалось удалить исходное сообщение с таймером: {e}")
+            logger.error("Не удалось удалить исходное сообщение с таймером: %s", e)
         
         # Отправляем новое сообщение с подтверждением
         message = None
@@ -1780,22 +1749,21 @@ def process_single_timer(update, context, minutes):
             
             # Если сообщение успешно отправлено, сохраняем его для возможного удаления
             if message:
-                context.user_data['last_bot_message'] = (message.chat_id, message.message_id)
-                logger.info(f"Отправлено сообщение с подтверждением, ID: {message.message_id}")
+                user_state['last_bot_message'] = (message.chat_id, message.message_id)
+                logger.info("Отправлено сообщение с подтверждением, ID: %s", message.message_id)
         except Exception as e:
-            logger.error(f"Ошибка при отправке сообщения с подтверждением: {e}")
+            logger.error("Ошибка при отправке сообщения с подтверждением: %s", e)
         
         # Сохраняем минуты в контексте для использования при подтверждении
-        context.user_data['timer_minutes'] = minutes
+        user_state['timer_minutes'] = minutes
         
         # Очищаем состояние пользователя, если оно было
-        if 'state' in context.user_data:
-            old_state = context.user_data.get('state')
-            del context.user_data['state']
-            logger.info(f"Очищено состояние пользователя {old_state} после обработки одиночного таймера")
+        old_state = user_state.pop('state', None)
+        if old_state is not None:
+            logger.info("Очищено состояние пользователя %s после обработки одиночного таймера", old_state)
         
     except Exception as e:
-        logger.error(f"Общая ошибка при обработке таймера: {e}")
+        logger.error("Общая ошибка при обработке таймера: %s", e)
         try:
             if hasattr(update.message, 'reply_text'):
                 update.message.reply_text(
@@ -1805,13 +1773,67 @@ def process_single_timer(update, context, minutes):
             pass
 
 
-def delete_message_later(context: CallbackContext):
-    """Удаляет сообщение бота через некоторое время"""
-    chat_id, message_id = context.job.context
+def delete_message_later(chat_id, message_id, delay):
+    """Ставит сообщение бота в очередь на удаление через delay секунд"""
+    with PENDING_DELETES_LOCK:
+        heapq.heappush(PENDING_DELETES, (time.monotonic() + delay, chat_id, message_id))
+
+
+def send_toast(context, chat_id, text, delete_after):
+    """Ставит короткое уведомление в очередь, уведомления за TOAST_DEBOUNCE секунд уходят одним сообщением"""
+    with TOAST_BUFFERS_LOCK:
+        buffer = TOAST_BUFFERS.setdefault(chat_id, [])
+        buffer.append((text, delete_after))
+        first = len(buffer) == 1
+
+    if first:
+        context.job_queue.run_once(flush_toasts, TOAST_DEBOUNCE, context=chat_id)
+
+
+def flush_toasts(context: CallbackContext):
+    """Отправляет накопленные уведомления чата одним сообщением"""
+    chat_id = context.job.context
+    with TOAST_BUFFERS_LOCK:
+        toasts = TOAST_BUFFERS.pop(chat_id, [])
+    if not toasts:
+        return
+
     try:
-        context.bot.delete_message(chat_id=chat_id, message_id=message_id)
+        message = context.bot.send_message(chat_id=chat_id, text="\n".join(text for text, _ in toasts))
+        delete_message_later(chat_id, message.message_id, max(delay for _, delay in toasts))
     except Exception as e:
-        logger.error(f"Ошибка при удалении сообщения: {e}")
+        logger.error("Не удалось отправить уведомления в чат %s: %s", chat_id, e)
+
+
+def sweep_pending_deletes(context: CallbackContext):
+    """Удаляет сообщения, время удаления которых наступило"""
+    now = time.monotonic()
+    due = []
+    with PENDING_DELETES_LOCK:
+        while PENDING_DELETES and PENDING_DELETES[0][0] <= now:
+            due.append(heapq.heappop(PENDING_DELETES))
+
+    # Группируем сообщения по чатам, чтобы удалять их одним запросом на чат
+    by_chat = defaultdict(list)
+    for _, chat_id, message_id in due:
+        by_chat[chat_id].append(message_id)
+
+    for chat_id, message_ids in by_chat.items():
+        # deleteMessages принимает не более 100 сообщений за раз
+        for i in range(0, len(message_ids), 100):
+            batch = message_ids[i:i + 100]
+            if len(batch) > 1 and hasattr(context.bot, 'delete_messages'):
+                try:
+                    context.bot.delete_messages(chat_id, batch)
+                    continue
+                except Exception as e:
+                    logger.info("Не удалось удалить сообщения одним запросом, удаляем по одному: %s", e)
+
+            for message_id in batch:
+                try:
+                    context.bot.delete_message(chat_id=chat_id, message_id=message_id)
+                except Exception as e:
+                    logger.error("Ошибка при удалении сообщения: %s", e)
 
 
 def send_message_with_auto_delete(update, context, text, reply_markup=None, delete_seconds=60):
@@ -1825,7 +1847,7 @@ def send_message_with_auto_delete(update, context, text, reply_markup=None, dele
                     text=text, reply_markup=reply_markup
                 )
             except Exception as e:
-                logger.error(f"Не удалось отредактировать сообщение: {e}")
+                logger.error("Не удалось отредактировать сообщение: %s", e)
                 # Если не удалось отредактировать, отправляем новое
                 message = update.callback_query.message.reply_text(
                     text=text, reply_markup=reply_markup
@@ -1838,15 +1860,11 @@ def send_message_with_auto_delete(update, context, text, reply_markup=None, dele
         
         # Планируем удаление сообщения
         if delete_seconds > 0 and message:
-            context.job_queue.run_once(
-                delete_message_later, 
-                delete_seconds, 
-                context=(message.chat_id, message.message_id)
-            )
+            delete_message_later(message.chat_id, message.message_id, delete_seconds)
         
         return message
     except Exception as e:
-        logger.error(f"Ошибка в функции send_message_with_auto_delete: {e}")
+        logger.error("Ошибка в функции send_message_with_auto_delete: %s", e)
         return None
 
 
@@ -1857,17 +1875,15 @@ def delete_message_if_exists(update, context):
             # Пытаемся удалить сообщение пользователя
             update.message.delete()
         except Exception as e:
-            logger.error(f"Не удалось удалить сообщение пользователя: {e}")
+            logger.error("Не удалось удалить сообщение пользователя: %s", e)
     
-    if 'last_bot_message' in context.user_data:
+    last_bot_message = context.user_data.pop('last_bot_message', None)
+    if last_bot_message:
         try:
-            chat_id, message_id = context.user_data['last_bot_message']
+            chat_id, message_id = last_bot_message
             context.bot.delete_message(chat_id=chat_id, message_id=message_id)
         except Exception as e:
-            logger.error(f"Не удалось удалить предыдущее сообщение бота: {e}")
-            # Удаляем ссылку на недоступное сообщение
-            if 'last_bot_message' in context.user_data:
-                del context.user_data['last_bot_message']
+            logger.error("Не удалось удалить предыдущее сообщение бота: %s", e)
 
 
 def change_notify_input(update: Update, context: CallbackContext) -> int:
@@ -1886,7 +1902,8 @@ def change_notify_input(update: Update, context: CallbackContext) -> int:
         return ConversationHandler.END
     
     # Обрабатываем ввод времени для ежедневных уведомлений
-    if not re.match(r'^\d{1,2}:\d{2}$', user_text):
+    match = HHMM_RE.match(user_text)
+    if not match:
         update.message.reply_text(
             "Неверный формат времени. Пожалуйста, используйте формат ЧЧ:ММ (например, 09:00)."
         )
@@ -1894,46 +1911,33 @@ def change_notify_input(update: Update, context: CallbackContext) -> int:
     
     try:
         # Разбираем время
-        hour, minute = map(int, user_text.split(':'))
+        hour, minute = int(match.group(1)), int(match.group(2))
         
         # Проверяем корректность времени
-        if hour < 0 or hour > 23 or minute < 0 or minute > 59:
+        if hour > 23 or minute > 59:
             update.message.reply_text(
                 "Неверное время. Часы должны быть от 0 до 23, минуты от 0 до 59."
             )
             return CHANGE_NOTIFY
         
-        # Удаляем существующие задачи для пользователя
-        for job in scheduler.get_jobs():
-            if job.id.startswith(f"notify_{user_id}"):
-                job.remove()
-        
-        # Настраиваем ежедневное уведомление в указанное время
-        scheduler.add_job(
-            send_notification, 'cron', hour=hour, minute=minute, id=f"notify_{user_id}_day",
-            args=(context, user_id), timezone=pytz.UTC
-        )
-        
         # Обновляем настройку в базе данных
-        db.update_notify_freq(user_id, f"day_{user_text}")
+        db.update_notify_freq(user_id, f"day_{hour:02d}:{minute:02d}")
         
         # Удаляем предыдущее сообщение с запросом и сообщение пользователя
         try:
             if hasattr(update, 'message') and update.message:
                 update.message.delete()
             
-            if 'last_bot_message' in context.user_data:
-                chat_id, message_id = context.user_data['last_bot_message']
+            last_bot_message = context.user_data.pop('last_bot_message', None)
+            if last_bot_message:
+                chat_id, message_id = last_bot_message
                 context.bot.delete_message(chat_id=chat_id, message_id=message_id)
-                del context.user_data['last_bot_message']
         except Exception as e:
-            logger.error(f"Ошибка при удалении сообщений: {e}")
+            logger.error("Ошибка при удалении сообщений: %s", e)
         
         # Очищаем состояние пользователя
-        if 'state' in context.user_data:
-            del context.user_data['state']
-        if 'notify_type' in context.user_data:
-            del context.user_data['notify_type']
+        context.user_data.pop('state', None)
+        context.user_data.pop('notify_type', None)
         
         # Отправляем подтверждение
         update.message.reply_text(
@@ -1946,7 +1950,7 @@ def change_notify_input(update: Update, context: CallbackContext) -> int:
         return ConversationHandler.END
     
     except Exception as e:
-        logger.error(f"Ошибка при настройке уведомлений: {e}")
+        logger.error("Ошибка при настройке уведомлений: %s", e)
         update.message.reply_text(
             "Произошла ошибка при настройке уведомлений. Пожалуйста, попробуйте позже."
         )
@@ -1980,15 +1984,14 @@ def change_rate_input(update: Update, context: CallbackContext) -> int:
     # Сохраняем текущее состояние в контексте пользователя
     context.user_data['state'] = CHANGE_RATE
     
-    logger.info(f"Обработка ввода новой ставки от пользователя {user_id}: '{user_text}'")
+    logger.info("Обработка ввода новой ставки от пользователя %s: '%s'", user_id, user_text)
     
     # Проверяем, не является ли это сообщением таймера
-    if "таймер остановлен" in user_text.lower() and "затрачено" in user_text.lower():
-        logger.info(f"Обнаружено сообщение таймера в состоянии CHANGE_RATE, обрабатываем напрямую")
+    if is_timer_message(user_text):
+        logger.info("Обнаружено сообщение таймера в состоянии CHANGE_RATE, обрабатываем напрямую")
         
         # Очищаем состояние пользователя
-        if 'state' in context.user_data:
-            del context.user_data['state']
+        context.user_data.pop('state', None)
             
         # Парсим время из сообщения таймера
         minutes = parse_timer_message(user_text)
@@ -2005,19 +2008,28 @@ def change_rate_input(update: Update, context: CallbackContext) -> int:
             )
             return CHANGE_RATE
     
+    # Очищаем ввод от лишних символов
+    rate_text = CURRENCY_RE.sub('', user_text).replace(',', '.').strip()
+    
+    logger.info("Очищенный текст ставки: '%s'", rate_text)
+    
     try:
-        # Очищаем ввод от лишних символов
-        rate_text = user_text.replace('₽', '').replace('р', '').replace('руб', '')
-        rate_text = rate_text.replace(',', '.').strip()
-        
-        logger.info(f"Очищенный текст ставки: '{rate_text}'")
-        
         rate = float(rate_text)
-        
+        if not math.isfinite(rate):
+            raise ValueError(f"Недопустимое значение: {rate_text}")
+    except ValueError as e:
+        logger.error("Ошибка преобразования ставки: %s", e)
+        update.message.reply_text(
+            "Пожалуйста, введите корректное числовое значение для почасовой ставки.\n"
+            "Например: 500 или 500₽"
+        )
+        return CHANGE_RATE
+    
+    try:
         # Обновляем ставку в базе данных
-        logger.info(f"Попытка обновить ставку для пользователя {user_id} на {rate}")
+        logger.info("Попытка обновить ставку для пользователя %s на %s", user_id, rate)
         db.update_rate(user_id, rate)
-        logger.info(f"Ставка успешно обновлена для пользователя {user_id}: {rate}")
+        logger.info("Ставка успешно обновлена для пользователя %s: %s", user_id, rate)
         
         # Удаляем предыдущее сообщение с запросом и сообщение пользователя
         try:
@@ -2026,28 +2038,23 @@ def change_rate_input(update: Update, context: CallbackContext) -> int:
                 update.message.delete()
                 logger.info("Сообщение пользователя удалено")
             
-            if 'last_bot_message' in context.user_data:
-                chat_id, message_id = context.user_data['last_bot_message']
+            last_bot_message = context.user_data.pop('last_bot_message', None)
+            if last_bot_message:
+                chat_id, message_id = last_bot_message
                 context.bot.delete_message(chat_id=chat_id, message_id=message_id)
-                logger.info(f"Сообщение бота {message_id} удалено")
-                del context.user_data['last_bot_message']
+                logger.info("Сообщение бота %s удалено", message_id)
         except Exception as e:
-            logger.error(f"Ошибка при удалении сообщений: {e}")
+            logger.error("Ошибка при удалении сообщений: %s", e)
         
         # Отправляем подтверждение
         logger.info("Отправка подтверждения")
         message = update.message.reply_text(f"✅ Ставка успешно обновлена: {rate:.0f}₽")
         
         # Планируем удаление сообщения
-        context.job_queue.run_once(
-            delete_message_later, 
-            5, 
-            context=(message.chat_id, message.message_id)
-        )
+        delete_message_later(message.chat_id, message.message_id, 5)
         
         # Очищаем состояние пользователя
-        if 'state' in context.user_data:
-            del context.user_data['state']
+        if context.user_data.pop('state', None) is not None:
             logger.info("Состояние пользователя очищено")
         
         # Показываем главное меню
@@ -2056,16 +2063,8 @@ def change_rate_input(update: Update, context: CallbackContext) -> int:
         
         return ConversationHandler.END
     
-    except ValueError as e:
-        logger.error(f"Ошибка преобразования ставки: {e}")
-        update.message.reply_text(
-            "Пожалуйста, введите корректное числовое значение для почасовой ставки.\n"
-            "Например: 500 или 500₽"
-        )
-        
-        return CHANGE_RATE
     except Exception as e:
-        logger.error(f"Общая ошибка при обновлении ставки: {e}")
+        logger.error("Общая ошибка при обновлении ставки: %s", e)
         update.message.reply_text(
             "Произошла ошибка при обработке вашего запроса. Пожалуйста, попробуйте позже."
         )
@@ -2081,16 +2080,15 @@ def change_goal_input(update: Update, context: CallbackContext) -> int:
     # Сохраняем текущее состояние в контексте пользователя
     context.user_data['state'] = CHANGE_GOAL
     
-    logger.info(f"Обработка ввода новой цели от пользователя {user_id}: '{user_text}'")
-    logger.info(f"DEBUG: Начало функции change_goal_input, текст: '{user_text}'")
+    logger.info("Обработка ввода новой цели от пользователя %s: '%s'", user_id, user_text)
+    logger.info("DEBUG: Начало функции change_goal_input, текст: '%s'", user_text)
     
     # Проверяем, не является ли это сообщением таймера
-    if "таймер остановлен" in user_text.lower() and "затрачено" in user_text.lower():
-        logger.info(f"Обнаружено сообщение таймера в состоянии CHANGE_GOAL, обрабатываем напрямую")
+    if is_timer_message(user_text):
+        logger.info("Обнаружено сообщение таймера в состоянии CHANGE_GOAL, обрабатываем напрямую")
         
         # Очищаем состояние пользователя
-        if 'state' in context.user_data:
-            del context.user_data['state']
+        context.user_data.pop('state', None)
             
         # Парсим время из сообщения таймера
         minutes = parse_timer_message(user_text)
@@ -2107,21 +2105,30 @@ def change_goal_input(update: Update, context: CallbackContext) -> int:
             )
             return CHANGE_GOAL
     
+    # Очищаем ввод от лишних символов
+    goal_text = CURRENCY_RE.sub('', user_text).replace(',', '.').strip()
+    
+    logger.info("Очищенный текст цели: '%s'", goal_text)
+    
     try:
-        # Очищаем ввод от лишних символов
-        goal_text = user_text.replace('₽', '').replace('р', '').replace('руб', '')
-        goal_text = goal_text.replace(',', '.').strip()
-        
-        logger.info(f"Очищенный текст цели: '{goal_text}'")
-        
         goal = float(goal_text)
-        logger.info(f"DEBUG: Преобразовано в число: {goal}")
-        
+        if not math.isfinite(goal):
+            raise ValueError(f"Недопустимое значение: {goal_text}")
+    except ValueError as e:
+        logger.error("Ошибка преобразования цели: %s", e)
+        update.message.reply_text(
+            "Пожалуйста, введите корректное числовое значение для цели заработка.\n"
+            "Например: 50000 или 50000₽"
+        )
+        return CHANGE_GOAL
+    logger.info("DEBUG: Преобразовано в число: %s", goal)
+    
+    try:
         # Обновляем цель в базе данных
-        logger.info(f"Попытка обновить цель для пользователя {user_id} на {goal}")
+        logger.info("Попытка обновить цель для пользователя %s на %s", user_id, goal)
         result = db.update_goal(user_id, goal)
-        logger.info(f"DEBUG: Результат обновления цели: {result}")
-        logger.info(f"Цель успешно обновлена для пользователя {user_id}: {goal}")
+        logger.info("DEBUG: Результат обновления цели: %s", result)
+        logger.info("Цель успешно обновлена для пользователя %s: %s", user_id, goal)
         
         # Удаляем предыдущее сообщение с запросом и сообщение пользователя
         try:
@@ -2130,29 +2137,24 @@ def change_goal_input(update: Update, context: CallbackContext) -> int:
                 update.message.delete()
                 logger.info("Сообщение пользователя удалено")
             
-            if 'last_bot_message' in context.user_data:
-                chat_id, message_id = context.user_data['last_bot_message']
+            last_bot_message = context.user_data.pop('last_bot_message', None)
+            if last_bot_message:
+                chat_id, message_id = last_bot_message
                 context.bot.delete_message(chat_id=chat_id, message_id=message_id)
-                logger.info(f"Сообщение бота {message_id} удалено")
-                del context.user_data['last_bot_message']
+                logger.info("Сообщение бота %s удалено", message_id)
         except Exception as e:
-            logger.error(f"Ошибка при удалении сообщений: {e}")
+            logger.error("Ошибка при удалении сообщений: %s", e)
         
         # Отправляем подтверждение и сразу показываем главное меню
         logger.info("Отправка подтверждения")
         message = update.message.reply_text(f"✅ Цель успешно обновлена: {goal:.0f}₽")
-        logger.info(f"DEBUG: Сообщение подтверждения отправлено, ID: {message.message_id}")
+        logger.info("DEBUG: Сообщение подтверждения отправлено, ID: %s", message.message_id)
         
         # Планируем удаление сообщения
-        context.job_queue.run_once(
-            delete_message_later, 
-            5, 
-            context=(message.chat_id, message.message_id)
-        )
+        delete_message_later(message.chat_id, message.message_id, 5)
         
         # Очищаем состояние пользователя
-        if 'state' in context.user_data:
-            del context.user_data['state']
+        if context.user_data.pop('state', None) is not None:
             logger.info("Состояние пользователя очищено")
         
         # Показываем главное меню
@@ -2161,16 +2163,8 @@ def change_goal_input(update: Update, context: CallbackContext) -> int:
     
         return ConversationHandler.END
     
-    except ValueError as e:
-        logger.error(f"Ошибка преобразования цели: {e}")
-        update.message.reply_text(
-            "Пожалуйста, введите корректное числовое значение для цели заработка.\n"
-            "Например: 50000 или 50000₽"
-        )
-        
-        return CHANGE_GOAL
     except Exception as e:
-        logger.error(f"Общая ошибка при обновлении цели: {e}")
+        logger.error("Общая ошибка при обновлении цели: %s", e)
         update.message.reply_text(
             "Произошла ошибка при обработке вашего запроса. Пожалуйста, попробуйте позже."
         )
@@ -2178,21 +2172,30 @@ def change_goal_input(update: Update, context: CallbackContext) -> int:
         return ConversationHandler.END
 
 
-def manual_time_input(update: Update, context: CallbackContext) -> int:
-    """Обработка ручного ввода времени"""
+def manual_time_input(update: Update, context: CallbackContext, is_command=False) -> int:
+    """Обработка ручного ввода времени (текстом или командой /add <время>)"""
     user_id = update.effective_user.id
-    time_input = update.message.text.strip()
+    if is_command:
+        # Время передается аргументами команды: /add 2ч 20м
+        time_input = " ".join(context.args or []).strip()
+        if not time_input:
+            update.message.reply_text(
+                "Использование: /add <время>\n"
+                "Например: /add 2ч 20м, /add 140мин или /add 2.33"
+            )
+            return ConversationHandler.END
+    else:
+        time_input = update.message.text.strip()
     
     # Сохраняем текущее состояние в контексте пользователя
     context.user_data['state'] = CONFIRM_TIME
     
     # Проверяем, не является ли это сообщением таймера
-    if "таймер остановлен" in time_input.lower() and "затрачено" in time_input.lower():
-        logger.info(f"Обнаружено сообщение таймера в состоянии CONFIRM_TIME, обрабатываем напрямую")
+    if is_timer_message(time_input):
+        logger.info("Обнаружено сообщение таймера в состоянии CONFIRM_TIME, обрабатываем напрямую")
         
         # Очищаем состояние пользователя
-        if 'state' in context.user_data:
-            del context.user_data['state']
+        context.user_data.pop('state', None)
             
         # Парсим время из сообщения таймера
         minutes = parse_timer_message(time_input)
@@ -2243,7 +2246,7 @@ def manual_time_input(update: Update, context: CallbackContext) -> int:
     try:
         update.message.delete()
     except Exception as e:
-        logger.error(f"Не удалось удалить сообщение пользователя: {e}")
+        logger.error("Не удалось удалить сообщение пользователя: %s", e)
     
     # Отправляем подтверждение с автоудалением
     send_message_with_auto_delete(
@@ -2254,8 +2257,7 @@ def manual_time_input(update: Update, context: CallbackContext) -> int:
     )
     
     # Очищаем состояние пользователя
-    if 'state' in context.user_data:
-        del context.user_data['state']
+    context.user_data.pop('state', None)
     
     # Показываем главное меню
     show_main_menu(update, context)
@@ -2265,6 +2267,11 @@ def manual_time_input(update: Update, context: CallbackContext) -> int:
 
 def main() -> None:
     """Основная функция запуска бота"""
+    # Проверяем, не завершается ли интерпретатор перед запуском бота
+    if hasattr(sys, '_shutdown_thread') and sys._shutdown_thread:
+        logger.error("Не удается запустить бота - интерпретатор завершает работу")
+        return
+
     # Получаем токен из переменных окружения
     TOKEN = os.getenv('TELEGRAM_TOKEN')
     if not TOKEN:
@@ -2272,7 +2279,10 @@ def main() -> None:
         return
 
     # Создаем экземпляр бота и диспетчера
-    updater = Updater(TOKEN)
+    # (пул соединений с запасом на потоки диспетчера, job_queue, планировщика уведомлений
+    # и обработки групп таймеров, чтобы рассылки не ждали свободного соединения)
+    bot = RateLimitedBot(TOKEN, request=Request(con_pool_size=32, connect_timeout=5, read_timeout=20))
+    updater = Updater(bot=bot, use_context=True)
     dispatcher = updater.dispatcher
 
     # Создаем обработчик разговора для регистрации
@@ -2301,60 +2311,173 @@ def main() -> None:
     dispatcher.add_handler(CommandHandler('stats', lambda update, context: show_main_menu(update, context)))
     dispatcher.add_handler(CommandHandler('rate', rate_command))
     dispatcher.add_handler(CommandHandler('goal', goal_command))
-    dispatcher.add_handler(CommandHandler('notify', notify_command))
-    dispatcher.add_handler(CommandHandler('add', lambda update, context: manual_time_input(update, context, is_command=True)))
+    dispatcher.add_handler(CommandHandler('notify', per_user(notify_command)))
+    dispatcher.add_handler(CommandHandler(
+        'add', per_user(lambda update, context: manual_time_input(update, context, is_command=True))
+    ))
     
-    # Обработчик кнопок
-    dispatcher.add_handler(CallbackQueryHandler(button_callback))
+    # Обработчик кнопок (выполняется в пуле потоков диспетчера, чтобы сетевые
+    # запросы одного пользователя не задерживали обработку остальных; нажатия
+    # одного пользователя обрабатываются по очереди, так как делят user_data)
+    dispatcher.add_handler(CallbackQueryHandler(per_user(button_callback)))
     
     # Обработчик обычных сообщений
-    dispatcher.add_handler(MessageHandler(Filters.text & ~Filters.command, process_timer_message))
+    # (записи в базу выполняются в пуле потоков, а не в потоке диспетчера,
+    # по очереди с остальными апдейтами того же пользователя)
+    dispatcher.add_handler(MessageHandler(Filters.text & ~Filters.command, per_user(process_timer_message)))
     
     # Добавляем обработчик ошибок
     dispatcher.add_error_handler(error_handler)
-    
-    # Регистрируем функцию очистки при завершении работы
-    import atexit
-    
-    def shutdown_hook():
-        """Функция, которая будет вызвана при завершении работы интерпретатора"""
-        logger.info("Завершение работы бота")
-        
-        # Останавливаем планировщик, если он запущен
-        try:
-            if scheduler and scheduler.running:
-                scheduler.shutdown(wait=False)
-                logger.info("Планировщик остановлен")
-        except Exception as e:
-            logger.error(f"Ошибка при остановке планировщика: {e}")
-    
-    # Регистрируем функцию очистки
-    atexit.register(shutdown_hook)
-    
-    # Проверяем, не завершается ли интерпретатор перед запуском бота
-    if hasattr(sys, '_shutdown_thread') and sys._shutdown_thread:
-        logger.error("Не удается запустить бота - интерпретатор завершает работу")
-        return
 
-    # Инициализируем обработчик групповых таймеров только если интерпретатор не завершается
-    if not (hasattr(sys, '_shutdown_thread') and sys._shutdown_thread):
-        scheduler.add_job(
-            process_grouped_timers,
-            'interval',
-            minutes=1,
-            id="process_grouped_timers",
-            args=(None,),  # Передаем None как признак вызова из планировщика
-            timezone=pytz.UTC
-        )
+    # Одна ежеминутная задача рассылает уведомления всем пользователям
+    scheduler.add_job(
+        dispatch_notifications, 'cron', minute='*', id='notify_dispatch',
+        args=(updater.bot,), timezone=UTC, coalesce=True, misfire_grace_time=30
+    )
+
+    # Одна периодическая задача удаляет все временные сообщения
+    updater.job_queue.run_repeating(sweep_pending_deletes, interval=1.0, first=1.0)
+
+    # Один поток обрабатывает группы пересланных таймеров по их срокам
+    threading.Thread(
+        target=group_flush_loop, args=(dispatcher,), name='group-timers', daemon=True
+    ).start()
 
-    # Запускаем бота
-    updater.start_polling()
+    # Запускаем бота: через вебхук, если задан его адрес, иначе через long polling
+    webhook_url = os.getenv('WEBHOOK_URL')
+    if webhook_url:
+        updater.start_webhook(
+            listen='0.0.0.0',
+            port=int(os.getenv('PORT', '8443')),
+            url_path=TOKEN,
+            webhook_url=webhook_url.rstrip('/') + '/' + TOKEN,
+            allowed_updates=ALLOWED_UPDATES
+        )
+        logger.info("Бот запущен в режиме вебхука")
+    else:
+        # Long polling с максимальным удержанием запроса на стороне Telegram
+        updater.start_polling(timeout=30, allowed_updates=ALLOWED_UPDATES)
     logger.info("Бот запущен и ожидает сообщений")
     
     # Ожидаем остановки
     updater.idle()
 
 
+def _notify_off(update, context, user_id):
+    """Отключение уведомлений"""
+    # Обновляем настройку в базе данных
+    db.update_notify_freq(user_id, 'off')
+
+    update.message.reply_text(
+        "Уведомления отключены."
+    )
+
+
+def _notify_hour(update, context, user_id):
+    """Ежечасные уведомления"""
+    # Обновляем настройку в базе данных
+    db.update_notify_freq(user_id, 'hour')
+
+    update.message.reply_text(
+        "Уведомления настроены на ежечасную отправку."
+    )
+
+
+def _notify_day(update, context, user_id):
+    """Ежедневные уведомления (опционально в указанное время)"""
+    time_str = "09:00"  # время по умолчанию
+
+    # Если указано конкретное время
+    if len(context.args) > 1:
+        time_str = context.args[1]
+
+        # Проверка формата времени
+        match = HHMM_RE.match(time_str)
+        if not match:
+            update.message.reply_text(
+                "Неверный формат времени. Используйте формат HH:MM (например, 09:00)."
+            )
+            return
+
+        # Проверяем корректность времени
+        hour, minute = int(match.group(1)), int(match.group(2))
+        if hour > 23 or minute > 59:
+            update.message.reply_text(
+                "Неверное время. Часы должны быть от 0 до 23, минуты от 0 до 59."
+            )
+            return
+        time_str = f"{hour:02d}:{minute:02d}"
+
+    try:
+        # Обновляем настройку в базе данных
+        db.update_notify_freq(user_id, f"day_{time_str}")
+
+        update.message.reply_text(
+            f"Уведомления настроены на ежедневную отправку в {time_str}."
+        )
+    except Exception as e:
+        logger.error("Ошибка при настройке ежедневных уведомлений: %s", e)
+        update.message.reply_text(
+            "Произошла ошибка при настройке уведомлений. Пожалуйста, попробуйте позже."
+        )
+
+
+def _notify_day_multi(update, context, user_id):
+    """Уведомления ежедневно в 09:00, 18:00 и 22:00"""
+    try:
+        # Обновляем настройку в базе данных
+        db.update_notify_freq(user_id, "day_multi")
+
+        update.message.reply_text(
+            "Уведомления настроены на ежедневную отправку в 09:00, 18:00 и 22:00."
+        )
+    except Exception as e:
+        logger.error("Ошибка при настройке множественных ежедневных уведомлений: %s", e)
+        update.message.reply_text(
+            "Произошла ошибка при настройке уведомлений. Пожалуйста, попробуйте позже."
+        )
+
+
+def _notify_week(update, context, user_id):
+    """Еженедельные уведомления (опционально в указанный день недели)"""
+    day_of_week = 0  # Понедельник по умолчанию
+
+    # Если указан день недели
+    if len(context.args) > 1:
+        try:
+            day_of_week = int(context.args[1])
+            if day_of_week < 0 or day_of_week > 6:
+                raise ValueError("День недели должен быть от 0 до 6")
+        except ValueError:
+            update.message.reply_text(
+                "Неверный формат дня недели. Используйте число от 0 до 6 (0=пн, 1=вт, 2=ср, 3=чт, 4=пт, 5=сб, 6=вс)."
+            )
+            return
+
+    try:
+        # Обновляем настройку в базе данных
+        db.update_notify_freq(user_id, f"week_{day_of_week}")
+
+        update.message.reply_text(
+            f"Уведомления настроены на еженедельную отправку в {DAY_NAMES_ACC[day_of_week]} в 09:00."
+        )
+    except Exception as e:
+        logger.error("Ошибка при настройке еженедельных уведомлений: %s", e)
+        update.message.reply_text(
+            "Произошла ошибка при настройке уведомлений. Пожалуйста, попробуйте позже."
+        )
+
+
+# Обработчики команды /notify по частоте уведомлений
+NOTIFY_HANDLERS = {
+    'off': _notify_off,
+    'hour': _notify_hour,
+    'day': _notify_day,
+    'day_multi': _notify_day_multi,
+    'week': _notify_week,
+}
+
+
 def notify_command(update: Update, context: CallbackContext) -> None:
     """Настройка уведомлений через команду"""
     user_id = update.effective_user.id
@@ -2371,168 +2494,14 @@ def notify_command(update: Update, context: CallbackContext) -> None:
         )
         return
     
-    freq = context.args[0].lower()
-    
-    # Проверка на базовые частоты уведомлений
-    if freq not in ['hour', 'day', 'day_multi', 'week', 'off']:
+    handler = NOTIFY_HANDLERS.get(context.args[0].lower())
+    if handler is None:
         update.message.reply_text(
             "Неверный параметр частоты. Используйте: hour, day, day_multi, week или off."
         )
         return
     
-    # Обработка отключения уведомлений
-    if freq == 'off':
-        # Удаляем все задачи для пользователя
-        for job in scheduler.get_jobs():
-            if job.id.startswith(f"notify_{user_id}"):
-                job.remove()
-        
-        # Обновляем настройку в базе данных
-        db.update_notify_freq(user_id, 'off')
-        
-        update.message.reply_text(
-            "Уведомления отключены."
-        )
-        return
-        
-    # Обработка ежечасных уведомлений
-    if freq == 'hour':
-        # Настраиваем уведомления ежечасно
-        setup_notification(context, user_id, 'hour')
-        
-        # Обновляем настройку в базе данных
-        db.update_notify_freq(user_id, 'hour')
-        
-        update.message.reply_text(
-            "Уведомления настроены на ежечасную отправку."
-        )
-        return
-        
-    # Обработка ежедневных уведомлений с указанным временем
-    if freq == 'day':
-        time_str = "09:00"  # время по умолчанию
-        
-        # Если указано конкретное время
-        if len(context.args) > 1:
-            time_str = context.args[1]
-            
-            # Проверка формата времени
-            import re
-            if not re.match(r'^\d{1,2}:\d{2}$', time_str):
-                update.message.reply_text(
-                    "Неверный формат времени. Используйте формат HH:MM (например, 09:00)."
-                )
-                return
-        
-        try:
-            # Удаляем существующие задачи для пользователя
-            for job in scheduler.get_jobs():
-                if job.id.startswith(f"notify_{user_id}"):
-                    job.remove()
-            
-            # Разбираем время
-            hour, minute = map(int, time_str.split(':'))
-            
-            # Настраиваем ежедневное уведомление в указанное время
-            scheduler.add_job(
-                send_notification, 'cron', hour=hour, minute=minute, id=f"notify_{user_id}_day",
-                args=(context, user_id), timezone=pytz.UTC
-            )
-            
-            # Обновляем настройку в базе данных
-            db.update_notify_freq(user_id, f"day_{time_str}")
-            
-            update.message.reply_text(
-                f"Уведомления настроены на ежедневную отправку в {time_str}."
-            )
-        except Exception as e:
-            logger.error(f"Ошибка при настройке ежедневных уведомлений: {e}")
-            update.message.reply_text(
-                "Произошла ошибка при настройке уведомлений. Пожалуйста, попробуйте позже."
-            )
-        return
-        
-    # Обработка множественных ежедневных уведомлений
-    if freq == 'day_multi':
-        try:
-            # Удаляем существующие задачи для пользователя
-            for job in scheduler.get_jobs():
-                if job.id.startswith(f"notify_{user_id}"):
-                    job.remove()
-            
-            # Фиксированные времена для уведомлений
-            times = [
-                (9, 0),   # 09:00
-                (18, 0),  # 18:00
-                (22, 0)   # 22:00
-            ]
-            
-            # Настраиваем уведомления на каждое время
-            for i, (hour, minute) in enumerate(times):
-                scheduler.add_job(
-                    send_notification, 'cron', hour=hour, minute=minute,
-                    id=f"notify_{user_id}_daily_{i}",
-                    args=(context, user_id), timezone=pytz.UTC
-                )
-            
-            # Обновляем настройку в базе данных
-            db.update_notify_freq(user_id, "day_multi")
-            
-            update.message.reply_text(
-                "Уведомления настроены на ежедневную отправку в 09:00, 18:00 и 22:00."
-            )
-        except Exception as e:
-            logger.error(f"Ошибка при настройке множественных ежедневных уведомлений: {e}")
-            update.message.reply_text(
-                "Произошла ошибка при настройке уведомлений. Пожалуйста, попробуйте позже."
-            )
-        return
-    
-    # Обработка еженедельных уведомлений
-    if freq == 'week':
-        day_of_week = 0  # Понедельник по умолчанию
-        
-        # Если указан день недели
-        if len(context.args) > 1:
-            try:
-                day_of_week = int(context.args[1])
-                if day_of_week < 0 or day_of_week > 6:
-                    raise ValueError("День недели должен быть от 0 до 6")
-            except ValueError:
-                update.message.reply_text(
-                    "Неверный формат дня недели. Используйте число от 0 до 6 (0=пн, 1=вт, 2=ср, 3=чт, 4=пт, 5=сб, 6=вс)."
-                )
-                return
-        
-        try:
-            # Удаляем существующие задачи для пользователя
-            for job in scheduler.get_jobs():
-                if job.id.startswith(f"notify_{user_id}"):
-                    job.remove()
-            
-            # Настраиваем еженедельное уведомление в указанный день недели
-            scheduler.add_job(
-                send_notification, 'cron', day_of_week=day_of_week, hour=9, minute=0,
-                id=f"notify_{user_id}_week",
-                args=(context, user_id), timezone=pytz.UTC
-            )
-            
-            # Преобразование числового дня недели в название
-            day_names = ["понедельник", "вторник", "среду", "четверг", "пятницу", "субботу", "воскресенье"]
-            day_name = day_names[day_of_week]
-            
-            # Обновляем настройку в базе данных
-            db.update_notify_freq(user_id, f"week_{day_of_week}")
-            
-            update.message.reply_text(
-                f"Уведомления настроены на еженедельную отправку в {day_name} в 09:00."
-            )
-        except Exception as e:
-            logger.error(f"Ошибка при настройке еженедельных уведомлений: {e}")
-            update.message.reply_text(
-                "Произошла ошибка при настройке уведомлений. Пожалуйста, попробуйте позже."
-            )
-        return
+    handler(update, context, user_id)
 
 
 if __name__ == "__main__":
@@ -1,20 +1,46 @@
 import re
 import io
 import os
+import math
+from functools import lru_cache
 from datetime import datetime, timedelta
-import matplotlib.pyplot as plt
-import matplotlib
-matplotlib.use('Agg')  # Используем Agg бэкенд, не требующий GUI
+from PIL import Image, ImageDraw, ImageFont
+
+
+# Шрифт с кириллицей поставляется вместе с ботом (fonts/LICENSE), системные шрифты не нужны
+FONT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fonts', 'DejaVuSans.ttf')
+
+# Параметры диаграммы прогресса, шрифты загружаются один раз при импорте
+CHART_SIZE = (800, 560)
+CHART_CENTER = (400, 320)
+CHART_RADIUS = 180
+CHART_MARGIN = 10
+CHART_COLORS = ((76, 175, 80), (236, 239, 241))
+CHART_TITLE_FONT = ImageFont.truetype(FONT_PATH, 20)
+CHART_LABEL_FONT = ImageFont.truetype(FONT_PATH, 15)
+
+# Готовые строки прогресс-бара для 0..10 заполненных делений
+PROGRESS_BARS = tuple('●' * filled + '○' * (10 - filled) for filled in range(11))
+
+# Регулярные выражения компилируются один раз при импорте
+HOURS_RE = re.compile(r'(\d+)ч')
+MINUTES_RE = re.compile(r'(\d+)м')  # совпадает и с "140мин"
+# Время после "Затрачено" (группы 1-3) или любое время HH:MM:SS в сообщении (группы 4-6)
+TIMER_TIME_RE = re.compile(r'Затрачено\s+(\d{2}):(\d{2}):(\d{2})|(\d{2}):(\d{2}):(\d{2})')
 
 
 def parse_time_input(time_input):
     """Парсинг ввода времени в различных форматах"""
     
-    # Проверка формата "2ч 20м" или "2ч" или "20м"
-    if re.search(r'(\d+)ч', time_input) or re.search(r'(\d+)м', time_input):
-        hours = re.search(r'(\d+)ч', time_input)
-        minutes = re.search(r'(\d+)м', time_input)
-        
+    # Число часов ("2" или "2.33") - самый частый ввод, проверяем без регулярных выражений
+    whole, dot, fraction = time_input.partition('.')
+    if whole.isdecimal() and (not dot or fraction.isdecimal()):
+        return int(float(time_input) * 60)
+    
+    # Проверка формата "2ч 20м", "2ч", "20м" или "140мин"
+    hours = HOURS_RE.search(time_input)
+    minutes = MINUTES_RE.search(time_input)
+    if hours or minutes:
         total_minutes = 0
         if hours:
             total_minutes += int(hours.group(1)) * 60
@@ -23,34 +49,21 @@ def parse_time_input(time_input):
         
         return total_minutes
     
-    # Проверка формата "140мин"
-    if re.search(r'(\d+)мин', time_input):
-        minutes = re.search(r'(\d+)мин', time_input)
-        return int(minutes.group(1))
-    
-    # Проверка формата числа с плавающей точкой (часы)
-    if re.match(r'^(\d+(\.\d+)?)$', time_input):
-        hours = float(time_input)
-        return int(hours * 60)
-    
-    # Проверка формата целого числа (предполагается минуты)
-    if time_input.isdigit():
-        return int(time_input)
-    
     # Если ничего не подошло
     return None
 
 
 def parse_timer_message(message_text):
     """Парсинг сообщения от таймера в формате "🛑 таймер остановлен ... Затрачено HH:MM:SS" """
-    # Регулярное выражение для извлечения времени в формате HH:MM:SS
-    time_pattern = r'Затрачено\s+(\d{2}):(\d{2}):(\d{2})'
-    
-    match = re.search(time_pattern, message_text)
-    if match:
-        hours = int(match.group(1))
-        minutes = int(match.group(2))
-        seconds = int(match.group(3))
+    # Один проход по сообщению: время после "Затрачено" имеет приоритет,
+    # иначе берем первое подходящее время HH:MM:SS
+    fallback = None
+    for match in TIMER_TIME_RE.finditer(message_text):
+        spent = match.group(1) is not None
+        if not spent and fallback is not None:
+            continue
+        
+        hours, minutes, seconds = map(int, match.group(1, 2, 3) if spent else match.group(4, 5, 6))
         
         # Переводим всё в минуты, округляя секунды до ближайшей минуты
         total_minutes = hours * 60 + minutes
@@ -58,45 +71,32 @@ def parse_timer_message(message_text):
             total_minutes += 1
         
         # Проверка на разумные значения (не более 24 часов за раз)
-        if 0 < total_minutes <= 24 * 60:
-            return total_minutes
-        else:
-            return None
-    
-    # Альтернативный паттерн (просто пытаемся найти время в формате HH:MM:SS где-нибудь в сообщении)
-    alt_pattern = r'(\d{2}):(\d{2}):(\d{2})'
-    
-    for match in re.finditer(alt_pattern, message_text):
-        hours = int(match.group(1))
-        minutes = int(match.group(2))
-        seconds = int(match.group(3))
+        valid = 0 < total_minutes <= 24 * 60
+        if spent:
+            return total_minutes if valid else None
         
         # Допустимый диапазон для рабочего времени
-        if 0 <= hours < 24 and 0 <= minutes < 60 and 0 <= seconds < 60:
-            total_minutes = hours * 60 + minutes
-            if seconds >= 30:
-                total_minutes += 1
-            
-            # Проверка на разумные значения (не более 24 часов за раз)
-            if 0 < total_minutes <= 24 * 60:
-                return total_minutes
+        if valid and hours < 24 and minutes < 60 and seconds < 60:
+            fallback = total_minutes
     
-    return None
+    return fallback
 
 
 def generate_progress_bar(percent):
     """Генерация ASCII-прогресс бара"""
-    # Используем символы прогресса
-    full_char = '●'
-    empty_char = '○'
-    
     # Количество заполненных символов (из 10)
-    filled = int(percent / 10)
-    
-    # Создаем бар
-    bar = full_char * filled + empty_char * (10 - filled)
+    filled = min(10, int(percent // 10))
     
-    return f"[{bar}] {percent}%"
+    return f"[{PROGRESS_BARS[filled]}] {percent}%"
+
+
+def draw_label(draw, position, text, anchor):
+    """Рисует подпись диаграммы, сдвигая ее внутрь изображения, если она выходит за край"""
+    x, y = position
+    left, top, right, bottom = draw.textbbox((x, y), text, font=CHART_LABEL_FONT, anchor=anchor)
+    x += max(0, CHART_MARGIN - left) - max(0, right - (CHART_SIZE[0] - CHART_MARGIN))
+    y += max(0, CHART_MARGIN - top) - max(0, bottom - (CHART_SIZE[1] - CHART_MARGIN))
+    draw.text((x, y), text, fill='black', font=CHART_LABEL_FONT, anchor=anchor)
 
 
 def create_progress_chart(progress_data):
@@ -109,54 +109,60 @@ def create_progress_chart(progress_data):
     remaining = goal - earned if goal > earned else 0
     sizes = [earned, remaining]
     labels = [f'Заработано: {earned:.0f}₽', f'Осталось: {remaining:.0f}₽']
-    colors = ['#4CAF50', '#ECEFF1']
-    
-    # Создаем диаграмму
-    plt.figure(figsize=(10, 6))
-    plt.clf()
-    
-    # Настраиваем шрифт для поддержки кириллицы
-    plt.rcParams['font.family'] = 'DejaVu Sans'
-    
-    # Круговая диаграмма
-    wedges, texts, autotexts = plt.pie(
-        sizes, 
-        labels=labels, 
-        colors=colors, 
-        autopct='%1.1f%%', 
-        startangle=90,
-        wedgeprops={'linewidth': 3, 'edgecolor': 'white'}
-    )
+    total = sum(sizes)
     
-    # Устанавливаем стиль текста
-    for text in texts + autotexts:
-        text.set_fontsize(12)
+    image = Image.new('RGB', CHART_SIZE, 'white')
+    draw = ImageDraw.Draw(image)
     
-    # Добавляем заголовок с информацией о прогрессе
-    plt.title(
+    # Заголовок с информацией о прогрессе
+    title = (
         f"Прогресс: {percent}% от цели в {goal:.0f}₽\n"
-        f"Осталось отработать: {progress_data['hours_left']:.1f} часов",
-        fontsize=16, 
-        pad=20
+        f"Осталось отработать: {progress_data['hours_left']:.1f} часов"
     )
+    draw.multiline_text((CHART_SIZE[0] / 2, 20), title, fill='black', font=CHART_TITLE_FONT,
+                        anchor='ma', align='center')
+    
+    cx, cy = CHART_CENTER
+    box = [cx - CHART_RADIUS, cy - CHART_RADIUS, cx + CHART_RADIUS, cy + CHART_RADIUS]
+    if total <= 0:
+        draw.ellipse(box, fill=CHART_COLORS[1])
+    
+    # Круговая диаграмма: сегменты идут против часовой стрелки от 12 часов
+    start_angle = 270
+    slice_labels = []
+    for size, label, color in zip(sizes, labels, CHART_COLORS):
+        if size <= 0:
+            continue
+        sweep = 360 * size / total
+        end_angle = start_angle - sweep
+        draw.pieslice(box, end_angle, start_angle, fill=color, outline='white', width=3)
+        
+        middle = math.radians(start_angle - sweep / 2)
+        slice_labels.append((math.cos(middle), math.sin(middle), f"{100 * size / total:.1f}%", label))
+        start_angle = end_angle
     
-    plt.axis('equal')  # Круглая форма
+    # Подписи рисуются поверх всех сегментов: процент внутри сегмента, сумма снаружи
+    for cos, sin, percent_text, label in slice_labels:
+        draw.text((cx + 0.6 * CHART_RADIUS * cos, cy + 0.6 * CHART_RADIUS * sin),
+                  percent_text, fill='black', font=CHART_LABEL_FONT, anchor='mm')
+        draw_label(draw, (cx + 1.1 * CHART_RADIUS * cos, cy + 1.1 * CHART_RADIUS * sin),
+                   label, 'lm' if cos >= 0 else 'rm')
     
     # Сохраняем в буфер
     buf = io.BytesIO()
-    plt.savefig(buf, format='png', dpi=100, bbox_inches='tight')
+    image.save(buf, 'PNG')
     buf.seek(0)
     
     return buf
 
 
+@lru_cache(maxsize=1024)
 def format_time(minutes):
     """Форматирование времени"""
     if minutes < 60:
         return f"{minutes}м"
     
-    hours = minutes // 60
-    mins = minutes % 60
+    hours, mins = divmod(minutes, 60)
     
     if mins == 0:
         return f"{hours}ч"
@@ -166,7 +172,17 @@ def format_time(minutes):
 
 def format_money(amount):
     """Форматирование денежной суммы"""
-    return f"{amount:.0f}₽"
+    # inf/nan не округлить до целого - форматируем как есть
+    if not math.isfinite(amount):
+        return f"{amount:.0f}₽"
+    # Кэшируем по сумме, округленной до рубля, - так же округляет формат :.0f
+    return _format_rubles(round(amount))
+
+
+@lru_cache(maxsize=2048)
+def _format_rubles(rubles):
+    """Форматирование целого числа рублей"""
+    return f"{rubles}₽"
 
 
 def format_progress_message(progress_data):
@@ -204,7 +220,12 @@ def format_time_record(record):
     """Форматирование записи времени для истории"""
     minutes = record["minutes"]
     earnings = format_money(record["earnings"])
-    timestamp = datetime.strptime(record["timestamp"], "%Y-%m-%d %H:%M:%S")
-    date_str = timestamp.strftime("%d.%m.%Y %H:%M")
+    date_str = format_record_date(record["timestamp"])
     
-    return f"{date_str} - {format_time(minutes)} ({earnings})" 
\ No newline at end of file
+    return f"{date_str} - {format_time(minutes)} ({earnings})"
+
+
+@lru_cache(maxsize=1024)
+def format_record_date(timestamp):
+    """Форматирование времени записи из базы ("YYYY-MM-DD HH:MM:SS") для истории"""
+    return datetime.fromisoformat(timestamp).strftime("%d.%m.%Y %H:%M") 
\ No newline at end of file